@@ -0,0 +1,2 @@
+from sov_bench.bench import compare_results, run_benchmark
+from sov_bench.generator import generate_sov_workbook
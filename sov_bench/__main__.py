@@ -0,0 +1,74 @@
+import argparse
+
+import sov_to_epcdb
+from sov_bulk import BULK_LOADERS
+from sov_bench.bench import (
+    DEFAULT_RESULTS_PATH,
+    REGRESSION_THRESHOLD,
+    compare_results,
+    load_results,
+    print_result,
+    run_benchmark,
+    save_result,
+)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m sov_bench",
+        description="Time SOV ingest stages on generated workbooks against SQLite",
+    )
+    parser.add_argument("--rows", type=int, default=1000, help="line items per sheet")
+    parser.add_argument(
+        "--workbooks", type=int, default=5, help="workbooks uploaded per repeat"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="repeats per stage")
+    parser.add_argument(
+        "--sheet",
+        action="append",
+        choices=sov_to_epcdb.SOV_SHEET_NAMES,
+        help="technology sheet to generate, repeatable (default: all)",
+    )
+    parser.add_argument(
+        "--bulk-method", default="multi", help="line item insert method"
+    )
+    parser.add_argument(
+        "--streaming", action="store_true", help="parse with the streaming reader"
+    )
+    parser.add_argument(
+        "--results",
+        default=DEFAULT_RESULTS_PATH,
+        help="JSON lines file the results are appended to and compared against",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=REGRESSION_THRESHOLD,
+        help="fractional slowdown of a stage reported as a regression",
+    )
+    parser.add_argument(
+        "--no-save", action="store_true", help="compare but do not store this run"
+    )
+    args = parser.parse_args(argv)
+    if args.bulk_method not in BULK_LOADERS:
+        parser.error(f"--bulk-method must be one of {', '.join(BULK_LOADERS)}")
+
+    result = run_benchmark(
+        rows=args.rows,
+        workbooks=args.workbooks,
+        repeat=args.repeat,
+        sheet_names=args.sheet or sov_to_epcdb.SOV_SHEET_NAMES,
+        bulk_method=args.bulk_method,
+        streaming=args.streaming,
+    )
+    print_result(result)
+    regressions = compare_results(
+        result, load_results(args.results), threshold=args.threshold
+    )
+    if not args.no_save:
+        save_result(result, args.results)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
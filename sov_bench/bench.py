@@ -0,0 +1,194 @@
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+
+import pandas as pd
+import sqlalchemy as sa
+
+import sov_to_epcdb
+from sov_bench.generator import generate_sov_workbook
+
+DEFAULT_RESULTS_PATH = os.path.join("~", ".sov", "bench_results.jsonl")
+# a stage whose median time grows by more than this fraction is a regression,
+# unless it grew by less than REGRESSION_MIN_SECONDS, which is timer noise
+REGRESSION_THRESHOLD = 0.2
+REGRESSION_MIN_SECONDS = 0.05
+STAGES = ["parse", "transform", "allocate", "insert"]
+
+
+def code_version() -> str:
+    # the git commit of the checkout being measured, if there is one
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(sov_to_epcdb.__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _timed(timings, stage, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    timings[stage] += time.perf_counter() - start
+    return result
+
+
+def run_benchmark(
+    rows=1000,
+    workbooks=5,
+    repeat=3,
+    sheet_names=sov_to_epcdb.SOV_SHEET_NAMES,
+    bulk_method="multi",
+    streaming=False,
+    work_dir=None,
+) -> dict:
+    # Time parse (reading the sheets), transform (SovSheetParser), allocate
+    # (allocate_ids) and insert (upload_sov_workbook of the parsed frames)
+    # separately over workbooks generated workbooks, repeat times, against a
+    # fresh SQLite database each repeat. Stage times are summed over the
+    # workbooks of a repeat.
+    params = {
+        "rows": rows,
+        "workbooks": workbooks,
+        "repeat": repeat,
+        "sheets": list(sheet_names),
+        "bulk_method": bulk_method,
+        "streaming": streaming,
+    }
+    runs = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        paths = [
+            generate_sov_workbook(
+                os.path.join(tmp, f"bench_{index}.xlsx"),
+                rows=rows,
+                sheet_names=sheet_names,
+                project_tracker_id=1000 + index,
+                seed=index,
+            )
+            for index in range(workbooks)
+        ]
+        for attempt in range(repeat):
+            engine = sa.create_engine(f"sqlite:///{tmp}/bench_{attempt}.db")
+            sov_to_epcdb.ensure_bookkeeping_tables(engine)
+            # create the tables up front so insert does not time the DDL
+            sov_to_epcdb.create_missing_tables(
+                engine, sov_to_epcdb.sov_metadata.sorted_tables
+            )
+            timings = dict.fromkeys(STAGES, 0.0)
+            for path in paths:
+                raw = _timed(
+                    timings,
+                    "parse",
+                    sov_to_epcdb.read_sov_workbook,
+                    path,
+                    sheet_names,
+                    streaming=streaming,
+                )
+                parsed = _timed(
+                    timings,
+                    "transform",
+                    lambda: {
+                        name: sov_to_epcdb.SOV_PARSERS[name](df_master)
+                        for name, df_master in raw.items()
+                    },
+                )
+                project_id = _timed(
+                    timings, "allocate", sov_to_epcdb.allocate_ids, engine
+                )
+                _timed(
+                    timings,
+                    "insert",
+                    sov_to_epcdb.upload_sov_workbook,
+                    path,
+                    engine,
+                    parsed=parsed,
+                    bulk_method=bulk_method,
+                    project_id=project_id,
+                    content_hash=uuid.uuid4().hex,
+                )
+            engine.dispose()
+            runs.append(timings)
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "version": code_version(),
+        "parse_version": sov_to_epcdb.SOV_PARSE_VERSION,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "sqlalchemy": sa.__version__,
+        "params": params,
+        "stages": {
+            stage: {
+                "median": statistics.median(run[stage] for run in runs),
+                "min": min(run[stage] for run in runs),
+            }
+            for stage in STAGES
+        },
+    }
+
+
+def load_results(results_path=DEFAULT_RESULTS_PATH) -> list:
+    results_path = os.path.expanduser(results_path)
+    if not os.path.exists(results_path):
+        return []
+    with open(results_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_result(result, results_path=DEFAULT_RESULTS_PATH) -> None:
+    # one JSON line per run, appended so the history of every version is kept
+    results_path = os.path.expanduser(results_path)
+    os.makedirs(os.path.dirname(os.path.abspath(results_path)), exist_ok=True)
+    with open(results_path, "a") as f:
+        f.write(json.dumps(result) + "\n")
+
+
+def compare_results(result, history, threshold=REGRESSION_THRESHOLD) -> list:
+    # stages slower than the latest earlier run with the same parameters
+    previous = [run for run in history if run["params"] == result["params"]]
+    if not previous:
+        print("No earlier run with these parameters to compare against")
+        return []
+    baseline = previous[-1]
+    regressions = []
+    for stage in STAGES:
+        before = baseline["stages"][stage]["median"]
+        after = result["stages"][stage]["median"]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > threshold and after - before > REGRESSION_MIN_SECONDS:
+            regressions.append(stage)
+            flag = "  REGRESSION"
+        print(
+            f"{stage:<10} {before:8.3f}s -> {after:8.3f}s ({change:+.0%} "
+            f"against {baseline['version']}){flag}"
+        )
+    return regressions
+
+
+def print_result(result) -> None:
+    params = result["params"]
+    line_items = params["rows"] * params["workbooks"] * len(params["sheets"])
+    print(
+        f"{params['workbooks']} workbooks x {len(params['sheets'])} sheets x "
+        f"{params['rows']} rows, {params['repeat']} repeats, "
+        f"bulk method {params['bulk_method']}, version {result['version']}"
+    )
+    for stage in STAGES:
+        median = result["stages"][stage]["median"]
+        rate = ""
+        if median and stage != "allocate":
+            rate = f"{line_items / median:10.0f} rows/s"
+        print(
+            f"{stage:<10} median {median:8.3f}s  "
+            f"min {result['stages'][stage]['min']:8.3f}s {rate}"
+        )
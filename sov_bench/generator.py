@@ -0,0 +1,111 @@
+import datetime
+import random
+
+import openpyxl
+from sqlalchemy import DateTime, Float, Integer
+
+from sov_to_epcdb import SOV_LAYOUTS, SOV_SHEET_NAMES
+
+UNITS = ["EA", "LF", "CY", "LS", "MW", "TON", "HR"]
+SCOPES = [
+    "Mobilization",
+    "Site Preparation",
+    "Civil Works",
+    "Pile Installation",
+    "Racking Installation",
+    "Module Installation",
+    "DC Collection",
+    "AC Collection",
+    "Substation Equipment",
+    "Commissioning",
+]
+COMMENTS = ["Per drawing set", "Allowance", "Excludes rock", "Vendor quote", "TBD"]
+
+
+def _header_value(label, column_type, rng, project_tracker_id, submitted):
+    if label == "Project Tracker ID":
+        return project_tracker_id
+    if column_type is Integer:
+        return rng.randint(1, 10_000)
+    if column_type is Float:
+        return round(rng.uniform(5, 500), 3)
+    if column_type is DateTime:
+        return submitted
+    if label == "Discharge Duration(hr)":
+        return rng.choice([2, 4, 6])
+    return f"{label} {project_tracker_id}"
+
+
+def _item_row(columns, index, rng):
+    # one line item as the estimators fill them in: mostly numbers, with the
+    # occasional lump sum or TBD in the numeric columns
+    quantity = (
+        rng.choice(["LS", "TBD"]) if rng.random() < 0.03 else rng.randint(1, 5000)
+    )
+    rate = round(rng.uniform(0.5, 2500), 2)
+    price = quantity * rate if isinstance(quantity, int) else rate
+    values = {
+        "Cost_Structure": f"{index // 100 + 1:02d}.{index // 10 % 10:02d}.{index % 10:02d}",
+        "Description": f"{rng.choice(SCOPES)} item {index}",
+        "Quantity": quantity,
+        "U_M": rng.choice(UNITS),
+        "Unit_Rate": rate,
+        "Extended_Price": round(price, 2),
+        "Comments": rng.choice(COMMENTS) if rng.random() < 0.2 else None,
+        "Typical_Inclusions": "Labor and material" if rng.random() < 0.5 else None,
+    }
+    # the price per unit of capacity column is named by technology
+    price_per = round(price / 100_000, 4)
+    return [
+        price_per if col.startswith("Price_per") else values.get(col) for col in columns
+    ]
+
+
+def generate_sov_workbook(
+    path,
+    rows=100,
+    sheet_names=SOV_SHEET_NAMES,
+    project_tracker_id=1001,
+    seed=0,
+    note_every=25,
+):
+    # Write a workbook with the given SOV sheets laid out exactly as
+    # SOV_LAYOUTS describes them: the header block in columns B and C, a title
+    # row, rows line items with a note row (no cost structure) every
+    # note_every rows, and the total rows. The same seed gives the same values.
+    rng = random.Random(seed)
+    submitted = datetime.datetime(2023, 1, 2) + datetime.timedelta(days=seed % 365)
+    workbook = openpyxl.Workbook(write_only=True)
+    workbook.create_sheet("Cover").append(["Schedule of Values"])
+    for name in sheet_names:
+        layout = SOV_LAYOUTS[name]
+        columns = layout["items"]
+        worksheet = workbook.create_sheet(name)
+        for label, _, column_type in layout["header"][: layout["header_rows"]]:
+            worksheet.append(
+                [
+                    None,
+                    label,
+                    _header_value(
+                        label, column_type, rng, project_tracker_id, submitted
+                    ),
+                ]
+            )
+        for _ in range(layout["header_rows"], layout["items_start"] - 1):
+            worksheet.append([])
+        worksheet.append([col.replace("_", " ") for col in columns])
+        total = 0.0
+        for index in range(rows):
+            if note_every and index and index % note_every == 0:
+                worksheet.append([None, f"Note: see scope section {index}"])
+            row = _item_row(columns, index, rng)
+            total += row[columns.index("Extended_Price")]
+            worksheet.append(row)
+        for index in range(layout["total_rows"]):
+            label = "Total" if index == layout["total_rows"] - 1 else "Subtotal"
+            row = [None] * len(columns)
+            row[1] = label
+            row[columns.index("Extended_Price")] = round(total, 2)
+            worksheet.append(row)
+    workbook.save(path)
+    return path
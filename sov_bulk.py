@@ -0,0 +1,184 @@
+import contextlib
+import sqlite3
+import uuid
+
+import sqlalchemy as sa
+
+# bound parameters a single statement may carry, per dialect
+PARAMETER_LIMITS = {
+    "mssql": 2098,
+    "sqlite": 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999,
+}
+# SQL Server rejects table value constructors with more than 1000 rows
+MAX_VALUES_ROWS = 1000
+EXECUTEMANY_CHUNKSIZE = 1000
+
+
+def sql_schema(con):
+    # the tables live in dbo on SQL Server, SQLite has no schemas
+    return "dbo" if con.dialect.name == "mssql" else None
+
+
+@contextlib.contextmanager
+def sql_transaction(con):
+    # run on the caller's connection, or on a fresh transaction of an engine
+    if isinstance(con, sa.engine.Engine):
+        with con.begin() as conn:
+            yield conn
+    else:
+        yield con
+
+
+def multi_values_chunksize(con, column_count) -> int:
+    limit = PARAMETER_LIMITS.get(con.dialect.name, 999)
+    return max(1, min(MAX_VALUES_ROWS, limit // max(1, column_count)))
+
+
+def insert_executemany(df, name, con, schema=None, chunksize=None) -> None:
+    # one executemany per chunk; with pyodbc's fast_executemany each chunk is a
+    # single array-bound round trip
+    df.to_sql(
+        name,
+        con,
+        schema=schema,
+        if_exists="append",
+        index=False,
+        chunksize=chunksize or EXECUTEMANY_CHUNKSIZE,
+    )
+
+
+def insert_multi_values(df, name, con, schema=None, chunksize=None) -> None:
+    # multi-row INSERT ... VALUES statements sized to the parameter limit
+    df.to_sql(
+        name,
+        con,
+        schema=schema,
+        if_exists="append",
+        index=False,
+        method="multi",
+        chunksize=chunksize or multi_values_chunksize(con, len(df.columns)),
+    )
+
+
+def insert_via_staging(df, name, con, schema=None, chunksize=None) -> None:
+    # load a scratch table, then publish it with one INSERT ... SELECT
+    stage_name = f"_stage_{name}_{uuid.uuid4().hex[:8]}"
+    with sql_transaction(con) as conn:
+        if not sa.inspect(conn).has_table(name, schema=schema):
+            df.head(0).to_sql(name, conn, schema=schema, index=False)
+        insert_multi_values(df, stage_name, conn, schema=schema, chunksize=chunksize)
+        metadata = sa.MetaData()
+        columns = [str(col) for col in df.columns]
+        target = sa.Table(
+            name, metadata, *[sa.Column(col) for col in columns], schema=schema
+        )
+        stage = sa.Table(
+            stage_name, metadata, *[sa.Column(col) for col in columns], schema=schema
+        )
+        try:
+            conn.execute(
+                target.insert().from_select(
+                    columns, sa.select(*[stage.c[col] for col in columns])
+                )
+            )
+        finally:
+            stage.drop(conn)
+
+
+def staging_table_name(con, name, schema=None):
+    # a session-private scratch table: a #temp table on SQL Server and a table
+    # in the temp schema on SQLite, so loading it takes no lock on the live
+    # tables and other sessions never see it
+    stage_name = f"stage_{name}_{uuid.uuid4().hex[:8]}"
+    if con.dialect.name == "mssql":
+        return f"#{stage_name}", None
+    if con.dialect.name == "sqlite":
+        return stage_name, "temp"
+    return f"_{stage_name}", schema
+
+
+def stage_frame(df, name, con, schema=None, chunksize=None, staged=None):
+    # load df into a new staging table for table name, or append it to the
+    # staging table staged, and return the staging table
+    if staged is None:
+        if not sa.inspect(con).has_table(name, schema=schema):
+            df.head(0).to_sql(name, con, schema=schema, index=False)
+        stage_name, stage_schema = staging_table_name(con, name, schema)
+        staged = sa.Table(
+            stage_name,
+            sa.MetaData(),
+            *[sa.Column(str(col)) for col in df.columns],
+            schema=stage_schema,
+        )
+    insert_multi_values(df, staged.name, con, schema=staged.schema, chunksize=chunksize)
+    return staged
+
+
+def publish_staged(con, staged, name, schema=None, key="id") -> None:
+    # Replace the rows of table name for every key in the staging table with
+    # the staged rows in one set-based statement, then drop the staging
+    # table. SQLite has no MERGE and takes a DELETE plus an INSERT ... SELECT
+    # inside the caller's transaction instead.
+    columns = [col.name for col in staged.columns]
+    target = sa.Table(
+        name, sa.MetaData(), *[sa.Column(col) for col in columns], schema=schema
+    )
+    try:
+        if con.dialect.name == "mssql":
+            quote = con.dialect.identifier_preparer
+            target_name = quote.format_table(target)
+            stage_name = quote.format_table(staged)
+            key_name = quote.quote(key)
+            column_list = ", ".join(quote.quote(col) for col in columns)
+            source_list = ", ".join(f"staged.{quote.quote(col)}" for col in columns)
+            # the CTE narrows the target to the staged keys; matching on 1 = 0
+            # inserts every staged row and deletes every row it replaces
+            con.execute(
+                sa.text(
+                    f"WITH live AS (SELECT * FROM {target_name} WHERE {key_name} IN "
+                    f"(SELECT {key_name} FROM {stage_name})) "
+                    f"MERGE live USING {stage_name} AS staged ON 1 = 0 "
+                    f"WHEN NOT MATCHED BY TARGET THEN INSERT ({column_list}) "
+                    f"VALUES ({source_list}) "
+                    "WHEN NOT MATCHED BY SOURCE THEN DELETE;"
+                )
+            )
+        else:
+            con.execute(
+                target.delete().where(
+                    target.c[key].in_(sa.select(staged.c[key]).distinct())
+                )
+            )
+            con.execute(
+                target.insert().from_select(
+                    columns, sa.select(*[staged.c[col] for col in columns])
+                )
+            )
+    finally:
+        staged.drop(con)
+
+
+def merge_via_staging(df, name, con, schema=None, chunksize=None) -> None:
+    # load a session staging table, then publish it keyed on the upload id
+    with sql_transaction(con) as conn:
+        staged = stage_frame(df, name, conn, schema=schema, chunksize=chunksize)
+        publish_staged(conn, staged, name, schema=schema)
+
+
+BULK_LOADERS = {
+    "executemany": insert_executemany,
+    "multi": insert_multi_values,
+    "staging": insert_via_staging,
+    "merge": merge_via_staging,
+}
+
+
+def bulk_insert(df, name, con, method="multi", schema=None, chunksize=None) -> None:
+    # append df to table name with one of the BULK_LOADERS strategies
+    if method not in BULK_LOADERS:
+        raise ValueError(
+            f"Unknown bulk load method {method!r}, expected one of {list(BULK_LOADERS)}"
+        )
+    if df.empty:
+        return
+    BULK_LOADERS[method](df, name, con, schema=schema, chunksize=chunksize)
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import pandas as pd
+
+import sov_metrics
+from sov_config import DEFAULT_CACHE_BYTES
+
+
+def file_digest(sov_sheet, chunk_size=1024 * 1024) -> str:
+    # content hash of a workbook path or an open binary file
+    digest = hashlib.sha256()
+    with sov_metrics.stage("hash"):
+        if hasattr(sov_sheet, "read"):
+            position = sov_sheet.tell()
+            for chunk in iter(lambda: sov_sheet.read(chunk_size), b""):
+                digest.update(chunk)
+            sov_sheet.seek(position)
+        else:
+            with open(sov_sheet, "rb") as f:
+                for chunk in iter(lambda: f.read(chunk_size), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _parquet_safe(df):
+    # Parquet needs text column names and one type per column. It would read
+    # integers of an object column back as floats (572 as 572.0), so object
+    # columns holding integers among missing values become nullable Int64,
+    # and columns mixing integers with floats or text are stored as text.
+    df = df.copy()
+    df.columns = df.columns.map(str)
+    for col in df.columns[df.dtypes == object]:
+        inferred = pd.api.types.infer_dtype(df[col], skipna=True)
+        if inferred == "integer":
+            df[col] = df[col].astype("Int64")
+        elif inferred in ("mixed", "mixed-integer", "mixed-integer-float"):
+            df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+
+class SovParseCache:
+    # Parsed (header, line items) frames stored as Parquet, keyed by workbook
+    # content hash and sheet name. Entries are touched on every hit and the
+    # least recently used ones are evicted once the cache exceeds max_bytes.
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_BYTES):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key, sheet_name, part):
+        entry = key if sheet_name is None else f"{key}-{sheet_name.replace(' ', '_')}"
+        return os.path.join(self.cache_dir, f"{entry}.{part}")
+
+    def _write(self, path, write):
+        # write to a temp file first so readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            write(tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def get(self, key, sheet_name):
+        paths = [
+            self._path(key, sheet_name, "header.parquet"),
+            self._path(key, sheet_name, "items.parquet"),
+        ]
+        try:
+            parsed = tuple(pd.read_parquet(path) for path in paths)
+            for path in paths:
+                os.utime(path)
+        except (FileNotFoundError, OSError):
+            return None
+        return parsed
+
+    def put(self, key, sheet_name, dfpivot, df) -> None:
+        for part, frame in (("header.parquet", dfpivot), ("items.parquet", df)):
+            frame = _parquet_safe(frame)
+            self._write(self._path(key, sheet_name, part), frame.to_parquet)
+        self.evict()
+
+    def get_workbook(self, key):
+        # all parsed sheets of a workbook, or None if any of them is missing
+        path = self._path(key, None, "sheets.json")
+        try:
+            with open(path) as f:
+                sheet_names = json.load(f)
+            os.utime(path)
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+        parsed = {}
+        for sheet_name in sheet_names:
+            parsed[sheet_name] = self.get(key, sheet_name)
+            if parsed[sheet_name] is None:
+                return None
+        return parsed
+
+    def put_workbook(self, key, parsed) -> None:
+        for sheet_name, (dfpivot, df) in parsed.items():
+            self.put(key, sheet_name, dfpivot, df)
+
+        def write_manifest(tmp):
+            with open(tmp, "w") as f:
+                json.dump(list(parsed), f)
+
+        self._write(self._path(key, None, "sheets.json"), write_manifest)
+
+    def size(self) -> int:
+        return sum(
+            entry.stat().st_size
+            for entry in os.scandir(self.cache_dir)
+            if entry.is_file() and not entry.name.endswith(".tmp")
+        )
+
+    def evict(self) -> None:
+        # group the files of each entry and drop whole entries, oldest first
+        entries = {}
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file() or entry.name.endswith(".tmp"):
+                continue
+            stat = entry.stat()
+            name = entry.name.split(".", 1)[0]
+            size, mtime, paths = entries.get(name, (0, 0, []))
+            entries[name] = (
+                size + stat.st_size,
+                max(mtime, stat.st_mtime),
+                paths + [entry.path],
+            )
+        total = sum(size for size, _, _ in entries.values())
+        for size, _, paths in sorted(entries.values(), key=lambda e: e[1]):
+            if total <= self.max_bytes:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
@@ -0,0 +1,388 @@
+import argparse
+import logging
+import os
+import re
+
+from sov_config import DEFAULT_CACHE_BYTES, db_settings, db_url
+
+# Console entry point. Only the stdlib and sov_config are imported up front;
+# pandas and SQLAlchemy come in with sov_to_epcdb once a command needs them,
+# so --help and status return immediately.
+
+
+def _masked(url) -> str:
+    return re.sub(r"://([^:/@]+):[^@]*@", r"://\1:***@", url)
+
+
+def _engine(args):
+    import sov_to_epcdb
+
+    return sov_to_epcdb.get_engine(args.db_url, config_path=args.config)
+
+
+def _parse_cache(args):
+    if not args.cache_dir:
+        return None
+    from sov_cache import SovParseCache
+
+    return SovParseCache(args.cache_dir, args.cache_size_mb * 2**20)
+
+
+def _check_bulk_method(parser, args) -> None:
+    from sov_bulk import BULK_LOADERS
+
+    if args.bulk_method not in BULK_LOADERS:
+        parser.error(
+            f"--bulk-method must be one of {', '.join(BULK_LOADERS)}, "
+            f"not {args.bulk_method!r}"
+        )
+
+
+def _check_chunk_options(parser, args) -> None:
+    # chunked uploads stream the sheets once, so they neither diff them
+    # against the last revision nor go through the parse cache
+    if args.chunk_rows and (args.delta or args.cache_dir):
+        parser.error("--chunk-rows cannot be combined with --delta or --cache-dir")
+
+
+def _check_sheet_options(parser, args) -> None:
+    # a single sheet is read whole or, with --chunk-rows, streamed in chunks
+    if args.sheet and args.streaming:
+        parser.error("--streaming cannot be combined with --sheet; use --chunk-rows")
+
+
+def cmd_upload(parser, args) -> int:
+    _check_bulk_method(parser, args)
+    _check_chunk_options(parser, args)
+    _check_sheet_options(parser, args)
+    import sov_to_epcdb
+
+    readsheetname = None
+    if args.sheet:
+        # accept the sheet name ("HV SOV") or its label ("hv")
+        for name, layout in sov_to_epcdb.SOV_LAYOUTS.items():
+            if args.sheet.lower() in (name.lower(), layout["label"].lower()):
+                readsheetname = name
+        if readsheetname is None:
+            parser.error(
+                f"--sheet must be one of {', '.join(sov_to_epcdb.SOV_LAYOUTS)}"
+            )
+    engine = _engine(args)
+    parse_cache = _parse_cache(args)
+    failed = []
+    for workbook in args.workbooks:
+        try:
+            if readsheetname and args.chunk_rows:
+                sov_to_epcdb.upload_sov_sheet_chunked(
+                    workbook,
+                    readsheetname,
+                    engine,
+                    keep_max_id=args.keep_max_id,
+                    chunk_rows=args.chunk_rows,
+                    bulk_method=args.bulk_method,
+                    skip_duplicates=not args.force,
+                )
+            elif readsheetname:
+                sov_to_epcdb.upload_sov_sheet(
+                    workbook,
+                    readsheetname,
+                    engine,
+                    keep_max_id=args.keep_max_id,
+                    parse_cache=parse_cache,
+                    bulk_method=args.bulk_method,
+                    skip_duplicates=not args.force,
+                    delta=args.delta,
+                )
+            else:
+                sov_to_epcdb.upload_sov_workbook(
+                    workbook,
+                    engine,
+                    keep_max_id=args.keep_max_id,
+                    streaming=args.streaming,
+                    parse_cache=parse_cache,
+                    bulk_method=args.bulk_method,
+                    skip_duplicates=not args.force,
+                    delta=args.delta,
+                    chunk_rows=args.chunk_rows,
+                )
+        except Exception as err:
+            print(f"{workbook} failed to upload: {err}")
+            failed.append(workbook)
+    return 1 if failed else 0
+
+
+def cmd_batch(parser, args) -> int:
+    _check_bulk_method(parser, args)
+    import sov_to_epcdb
+
+    failed = sov_to_epcdb.batch_upload_sov(
+        args.sov_path,
+        _engine(args),
+        max_workers=args.workers,
+        streaming=args.streaming,
+        parse_cache=_parse_cache(args),
+        bulk_method=args.bulk_method,
+        skip_duplicates=not args.force,
+        delta=args.delta,
+        writers=args.writers,
+    )
+    return 1 if failed else 0
+
+
+def cmd_watch(parser, args) -> int:
+    _check_bulk_method(parser, args)
+    _check_chunk_options(parser, args)
+    import sov_watch
+
+    options = {}
+    if args.queue:
+        options["queue_path"] = args.queue
+    counts = sov_watch.watch_folder(
+        args.folder,
+        db_url=args.db_url,
+        config_path=args.config,
+        poll_interval=args.interval,
+        max_workers=args.workers,
+        max_attempts=args.max_attempts,
+        once=args.once,
+        streaming=args.streaming,
+        parse_cache=_parse_cache(args),
+        bulk_method=args.bulk_method,
+        skip_duplicates=not args.force,
+        delta=args.delta,
+        chunk_rows=args.chunk_rows,
+        **options,
+    )
+    print(", ".join(f"{count} {status}" for status, count in counts.items()))
+    return 1 if counts.get("failed") else 0
+
+
+def cmd_migrate(parser, args) -> int:
+    import sov_migrate
+    import sov_to_epcdb
+
+    engine = _engine(args)
+    # the allocator is seeded from the id columns, so they are migrated first
+    sov_migrate.run_migrations(engine, batch_rows=args.batch_rows)
+    sov_to_epcdb.ensure_bookkeeping_tables(engine)
+    # indexed only after the column swaps, which cannot drop indexed columns
+    sov_to_epcdb.ensure_sov_indexes(engine, create=not args.no_indexes)
+    if args.rebuild_summary:
+        sov_to_epcdb.rebuild_cost_summary(engine)
+    return 0
+
+
+def cmd_status(parser, args) -> int:
+    settings = db_settings(args.config)
+    print(f"database: {_masked(args.db_url or db_url(settings))}")
+    print(f"config: {args.config or os.environ.get('SOV_CONFIG') or '(defaults)'}")
+    for key, value in settings.items():
+        if key != "url":
+            print(f"  {key}: {value}")
+    if args.cache_dir:
+        size = 0
+        if os.path.isdir(args.cache_dir):
+            size = sum(
+                entry.stat().st_size
+                for entry in os.scandir(args.cache_dir)
+                if entry.is_file()
+            )
+        print(f"parse cache: {args.cache_dir} ({size / 2**20:.1f} MiB)")
+    if not args.check:
+        return 0
+    import sqlalchemy as sa
+    import sov_to_epcdb
+    from sov_bulk import sql_schema
+
+    engine = _engine(args)
+    # read only: the bookkeeping tables are reported, never created or seeded
+    last_id = ingested = "(no table)"
+    try:
+        with engine.connect() as connection:
+            inspector = sa.inspect(connection)
+            schema = sql_schema(connection)
+            if inspector.has_table(sov_to_epcdb.ID_ALLOCATOR.name, schema=schema):
+                last_id = connection.execute(
+                    sa.select(sov_to_epcdb.ID_ALLOCATOR.c.last_id).where(
+                        sov_to_epcdb.ID_ALLOCATOR.c.name
+                        == sov_to_epcdb.PROJECT_ID_SEQUENCE
+                    )
+                ).scalar()
+            if inspector.has_table(sov_to_epcdb.INGEST_LEDGER.name, schema=schema):
+                ingested = connection.execute(
+                    sa.select(sa.func.count()).select_from(sov_to_epcdb.INGEST_LEDGER)
+                ).scalar()
+    except sa.exc.SQLAlchemyError as err:
+        print(f"database unreachable: {err}")
+        return 1
+    print(f"last project id: {last_id}")
+    print(f"ingested sheets: {ingested}")
+    missing = sov_to_epcdb.ensure_sov_indexes(engine, create=False)
+    print(f"missing indexes: {len(missing)}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="sov", description="Upload SOV workbooks to EPC_SOV"
+    )
+    parser.add_argument(
+        "--db-url", help="SQLAlchemy url, e.g. sqlite:///epc_sov.db for local runs"
+    )
+    parser.add_argument(
+        "--config", help="ini file with a [database] section (default: $SOV_CONFIG)"
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="log per-upload stage timings and counters as JSON on stderr",
+    )
+    parser.add_argument(
+        "--metrics-file", help="append per-upload metrics to this JSON lines file"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_upload_options(command):
+        command.add_argument(
+            "--streaming",
+            action="store_true",
+            help="read only the SOV cell range with the read-only streaming reader",
+        )
+        command.add_argument(
+            "--cache-dir", help="reuse parsed sheets from this on-disk parse cache"
+        )
+        command.add_argument(
+            "--cache-size-mb",
+            type=int,
+            default=DEFAULT_CACHE_BYTES // 2**20,
+            help="size bound of the parse cache before LRU eviction",
+        )
+        command.add_argument(
+            "--bulk-method",
+            default="multi",
+            help="how line items are inserted: executemany, multi, staging or merge",
+        )
+        command.add_argument(
+            "--delta",
+            action="store_true",
+            help="store revisions as changes against the project's latest upload",
+        )
+        command.add_argument(
+            "--force",
+            action="store_true",
+            help="upload workbooks again even if the ledger already has them",
+        )
+
+    def add_chunk_option(command):
+        command.add_argument(
+            "--chunk-rows",
+            type=int,
+            default=None,
+            help="stream line items into the database this many rows at a time",
+        )
+
+    upload = commands.add_parser("upload", help="upload single workbooks")
+    upload.add_argument("workbooks", nargs="+", help="SOV workbooks to upload")
+    upload.add_argument(
+        "--sheet", help="upload only this technology sheet, e.g. HV or 'HV SOV'"
+    )
+    upload.add_argument(
+        "--keep-max-id",
+        action="store_true",
+        help="link to the most recently allocated project id",
+    )
+    add_chunk_option(upload)
+    add_upload_options(upload)
+    upload.set_defaults(run=cmd_upload)
+
+    batch = commands.add_parser("batch", help="upload a folder or glob of workbooks")
+    batch.add_argument("sov_path", help="folder or glob of SOV workbooks")
+    batch.add_argument(
+        "--workers", type=int, default=None, help="parser processes (default: cores)"
+    )
+    batch.add_argument(
+        "--writers",
+        type=int,
+        default=1,
+        help="threads writing parsed workbooks to the database",
+    )
+    add_upload_options(batch)
+    batch.set_defaults(run=cmd_batch)
+
+    watch = commands.add_parser(
+        "watch", help="upload workbooks as they are dropped into a folder"
+    )
+    watch.add_argument("folder", help="drop folder to watch")
+    watch.add_argument(
+        "--queue", help="SQLite file of the ingest queue (default: ~/.sov/)"
+    )
+    watch.add_argument(
+        "--interval", type=float, default=2.0, help="seconds between folder polls"
+    )
+    watch.add_argument(
+        "--workers", type=int, default=2, help="uploads running at the same time"
+    )
+    watch.add_argument(
+        "--max-attempts",
+        type=int,
+        default=5,
+        help="uploads of a file before it is marked failed",
+    )
+    watch.add_argument(
+        "--once",
+        action="store_true",
+        help="stop once the folder is processed instead of running forever",
+    )
+    add_chunk_option(watch)
+    add_upload_options(watch)
+    watch.set_defaults(run=cmd_watch)
+
+    migrate = commands.add_parser(
+        "migrate", help="bring the database schema up to date"
+    )
+    migrate.add_argument(
+        "--rebuild-summary",
+        action="store_true",
+        help="recompute the cost summary table from all stored uploads",
+    )
+    migrate.add_argument(
+        "--no-indexes",
+        action="store_true",
+        help="only report missing indexes instead of creating them",
+    )
+    migrate.add_argument(
+        "--batch-rows",
+        type=int,
+        default=5000,
+        help="rows backfilled per transaction; interrupted runs resume. On SQL "
+        "Server editions without online index builds (Standard, Express) the "
+        "index over the new column blocks uploads while it is built",
+    )
+    migrate.set_defaults(run=cmd_migrate)
+
+    status = commands.add_parser("status", help="show the resolved configuration")
+    status.add_argument("--cache-dir", help="also report the size of this parse cache")
+    status.add_argument(
+        "--check",
+        action="store_true",
+        help="connect and report the last project id and ingested sheet count",
+    )
+    status.set_defaults(run=cmd_status)
+    return parser
+
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.metrics:
+        logging.basicConfig(format="%(message)s")
+        logging.getLogger("sov.metrics").setLevel(logging.INFO)
+    if args.metrics_file:
+        import sov_metrics
+
+        sov_metrics.add_exporter(sov_metrics.jsonl_exporter(args.metrics_file))
+    return args.run(parser, args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,53 @@
+import configparser
+import os
+from urllib.parse import quote_plus
+
+# default size bound of the on-disk parse cache
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+# every key can be set in the [database] section of the file named by
+# SOV_CONFIG, and overridden by an SOV_DB_<KEY> environment variable
+DB_DEFAULTS = {
+    "url": "",
+    "server": "sdhqhopsql01d",
+    "database": "EPC_SOV",
+    "driver": "ODBC Driver 17 for SQL Server",
+    "pool_size": "5",
+    "max_overflow": "10",
+    "pool_timeout": "30",
+    "pool_recycle": "3600",
+    "pool_pre_ping": "true",
+    "fast_executemany": "true",
+    "connect_timeout": "30",
+}
+
+
+def db_settings(config_path=None) -> dict:
+    settings = dict(DB_DEFAULTS)
+    config_path = config_path or os.environ.get("SOV_CONFIG")
+    if config_path:
+        parser = configparser.ConfigParser()
+        parser.read(config_path)
+        if parser.has_section("database"):
+            settings.update(parser["database"])
+    for key in settings:
+        value = os.environ.get(f"SOV_DB_{key.upper()}")
+        if value is not None:
+            settings[key] = value
+    return settings
+
+
+def db_url(settings) -> str:
+    # an explicit url (e.g. sqlite:///epc_sov.db for local runs) wins over
+    # the SQL Server connection pieces
+    if settings["url"]:
+        return settings["url"]
+    return "mssql+pyodbc://{srv}/{db}?trusted_connection=yes&driver={dr}".format(
+        srv=settings["server"],
+        db=settings["database"],
+        dr=quote_plus(settings["driver"]),
+    )
+
+
+def as_bool(value) -> bool:
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
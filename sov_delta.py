@@ -0,0 +1,103 @@
+import pandas as pd
+
+# line items are matched between revisions on these columns; repeated keys
+# are told apart by their occurrence number (Delta_Seq)
+DELTA_KEYS = ["Cost_Structure", "Description"]
+DELTA_ADDED = "A"
+DELTA_CHANGED = "C"
+DELTA_REMOVED = "D"
+
+
+def _match_keys(df):
+    keys = pd.DataFrame(
+        {col: df[col].map(lambda v: "" if pd.isna(v) else str(v)) for col in DELTA_KEYS}
+    )
+    keys["Delta_Seq"] = keys.groupby(DELTA_KEYS, sort=False).cumcount()
+    return keys
+
+
+def _comparable(value):
+    # stored revisions come back from the database as text or float, so
+    # compare numbers numerically and everything else as stripped text
+    if pd.isna(value):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return str(value).strip()
+    return None if pd.isna(number) else number
+
+
+def diff_sov_items(base, new, value_columns=None):
+    # rows of new that were added or changed relative to base, plus the keys of
+    # rows that were removed, tagged with Delta_Op and Delta_Seq
+    value_columns = value_columns or [
+        col for col in new.columns if col not in DELTA_KEYS and col != "id"
+    ]
+    base_keys = _match_keys(base).reset_index(drop=True)
+    new_keys = _match_keys(new).reset_index(drop=True)
+    merged = new_keys.reset_index().merge(
+        base_keys.reset_index(),
+        on=DELTA_KEYS + ["Delta_Seq"],
+        how="outer",
+        suffixes=("_new", "_base"),
+        indicator=True,
+    )
+    base = base.reset_index(drop=True)
+    new = new.reset_index(drop=True)
+
+    # the outer join turns the row positions into floats
+    added = merged[merged["_merge"] == "left_only"].astype({"index_new": int})
+    both = merged[merged["_merge"] == "both"].astype(
+        {"index_new": int, "index_base": int}
+    )
+    removed = merged[merged["_merge"] == "right_only"].astype({"index_base": int})
+
+    new_values = new.loc[both["index_new"], value_columns].values.tolist()
+    base_values = base.reindex(columns=value_columns).loc[both["index_base"]]
+    # compared cell by cell so missing values on both sides count as equal
+    unchanged = [
+        [_comparable(v) for v in new_row] == [_comparable(v) for v in base_row]
+        for new_row, base_row in zip(new_values, base_values.values.tolist())
+    ]
+    changed = both[[not same for same in unchanged]]
+
+    parts = []
+    for rows, op in ((added, DELTA_ADDED), (changed, DELTA_CHANGED)):
+        part = new.loc[rows["index_new"]].copy()
+        part["Delta_Op"] = op
+        part["Delta_Seq"] = rows["Delta_Seq"].to_numpy()
+        parts.append(part)
+    part = base.loc[removed["index_base"], DELTA_KEYS].copy()
+    part["Delta_Op"] = DELTA_REMOVED
+    part["Delta_Seq"] = removed["Delta_Seq"].to_numpy()
+    parts.append(part)
+    delta = pd.concat(parts, ignore_index=True)
+    return delta.reindex(columns=list(new.columns) + ["Delta_Op", "Delta_Seq"])
+
+
+def apply_sov_delta(base, delta):
+    # rebuild a revision from its base: changed rows are replaced in place,
+    # removed rows dropped and added rows appended in upload order
+    base = base.reset_index(drop=True)
+    keys = _match_keys(base)
+    delta_keys = _match_keys(delta)
+    delta_keys["Delta_Seq"] = delta["Delta_Seq"].astype(int).to_numpy()
+    delta_keys["Delta_Op"] = delta["Delta_Op"].to_numpy()
+    delta_keys["delta_row"] = range(len(delta))
+    located = keys.merge(delta_keys, on=DELTA_KEYS + ["Delta_Seq"], how="left")
+
+    columns = [col for col in delta.columns if col not in ("Delta_Op", "Delta_Seq")]
+    rows = []
+    for position, (op, delta_row) in enumerate(
+        zip(located["Delta_Op"], located["delta_row"])
+    ):
+        if op == DELTA_REMOVED:
+            continue
+        if op == DELTA_CHANGED:
+            rows.append(delta.iloc[int(delta_row)][columns])
+        else:
+            rows.append(base.iloc[position].reindex(columns))
+    added = delta[delta["Delta_Op"] == DELTA_ADDED][columns]
+    rebuilt = pd.DataFrame(rows, columns=columns)
+    return pd.concat([rebuilt, added], ignore_index=True)
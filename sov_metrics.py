@@ -0,0 +1,150 @@
+import contextlib
+import contextvars
+import datetime
+import functools
+import json
+import logging
+import time
+
+import sqlalchemy as sa
+
+# Per-upload timing and counters. An upload runs inside trace(); stage()
+# adds wall time to a named stage and count() bumps a counter of the active
+# trace. Statements sent on any engine while a trace is active are counted as
+# round trips. Finished traces go to every registered exporter as one flat
+# record. Traces are held in a context variable, so the writer threads of a
+# batch each record their own uploads.
+
+logger = logging.getLogger("sov.metrics")
+COUNTERS = ["rows_written", "bytes_read", "round_trips"]
+_current_trace = contextvars.ContextVar("sov_trace", default=None)
+
+
+class IngestTrace:
+    def __init__(self, operation, **fields):
+        self.operation = operation
+        self.fields = {"status": "ok", **fields}
+        self.stages = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.started_at = datetime.datetime.now()
+        self.elapsed = 0.0
+
+    def record(self) -> dict:
+        return {
+            "operation": self.operation,
+            "started_at": self.started_at.isoformat(timespec="milliseconds"),
+            "elapsed": round(self.elapsed, 6),
+            **self.fields,
+            "stages": {name: round(secs, 6) for name, secs in self.stages.items()},
+            **self.counters,
+        }
+
+
+def log_exporter(record) -> None:
+    # one JSON object per upload on the sov.metrics logger
+    logger.info(json.dumps(record, default=str))
+
+
+def jsonl_exporter(path):
+    # an exporter appending each record to a JSON lines file
+    def export(record):
+        with open(path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+    return export
+
+
+_exporters = [log_exporter]
+
+
+def add_exporter(exporter):
+    # exporter is called with the record dict of every finished trace
+    _exporters.append(exporter)
+    return exporter
+
+
+def remove_exporter(exporter) -> None:
+    if exporter in _exporters:
+        _exporters.remove(exporter)
+
+
+def export(record) -> None:
+    # a failing exporter must never fail the upload it reports on
+    for exporter in list(_exporters):
+        try:
+            exporter(record)
+        except Exception as err:
+            logger.warning("metrics exporter %r failed: %s", exporter, err)
+
+
+@contextlib.contextmanager
+def trace(operation, **fields):
+    # a trace opened inside another one joins it, so the sheets of a
+    # workbook upload are reported as one record
+    current = _current_trace.get()
+    if current is not None:
+        yield current
+        return
+    current = IngestTrace(operation, **fields)
+    token = _current_trace.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as err:
+        current.fields["status"] = "failed"
+        current.fields["error"] = str(err)
+        raise
+    finally:
+        current.elapsed = time.perf_counter() - start
+        _current_trace.reset(token)
+        export(current.record())
+
+
+def traced(operation):
+    # decorator running an upload function, whose first argument is the
+    # workbook, inside a trace
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(sov_sheet, *args, **kwargs):
+            source = str(getattr(sov_sheet, "name", sov_sheet))
+            with trace(operation, source=source):
+                return func(sov_sheet, *args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def add_stage_time(name, seconds) -> None:
+    current = _current_trace.get()
+    if current is not None:
+        current.stages[name] = current.stages.get(name, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def stage(name):
+    # stages of one trace should not nest, or their times are counted twice
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(name, time.perf_counter() - start)
+
+
+def count(name, value=1) -> None:
+    current = _current_trace.get()
+    if current is not None:
+        current.counters[name] = current.counters.get(name, 0) + value
+
+
+def annotate(**fields) -> None:
+    # set fields such as the upload id or a skipped status on the active trace
+    current = _current_trace.get()
+    if current is not None:
+        current.fields.update(fields)
+
+
+@sa.event.listens_for(sa.engine.Engine, "before_cursor_execute")
+def _count_round_trip(conn, cursor, statement, parameters, context, executemany):
+    # an executemany is a single round trip with pyodbc's fast_executemany
+    count("round_trips")
@@ -0,0 +1,265 @@
+import datetime
+
+import sqlalchemy as sa
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+
+from sov_bulk import sql_schema
+from sov_to_epcdb import SOV_PROJECT_TABLES, create_missing_tables
+
+# Online schema migrations. A migration adds its new column (metadata only)
+# and a filtered index on the rows where it is still NULL, backfills it
+# batch_rows rows at a time, each batch in its own short transaction that
+# also records the progress, and finally catches up rows written meanwhile,
+# drops the index and swaps the columns in one transaction. Every batch finds
+# its rows through the index, so none of them scans the table, and updated
+# rows drop out of it. Uploads keep running in between, and an interrupted
+# migration resumes with the rows still pending.
+
+MIGRATION_BATCH_ROWS = 5000
+# SQL Server editions that build indexes online (SERVERPROPERTY('EngineEdition')):
+# Enterprise and Developer, Azure SQL Database and Azure SQL Managed Instance
+MSSQL_ONLINE_INDEX_EDITIONS = {3, 5, 8}
+migration_metadata = MetaData()
+MIGRATION_STATE = Table(
+    "sov_migration_state",
+    migration_metadata,
+    Column("name", String(200), primary_key=True),
+    Column("step", String(20), nullable=False),
+    Column("rows_done", Integer, nullable=False),
+    Column("updated_at", DateTime),
+)
+
+
+def migration_state(sql_engine, name):
+    create_missing_tables(sql_engine, [MIGRATION_STATE])
+    with sql_engine.connect() as connection:
+        row = connection.execute(
+            sa.select(MIGRATION_STATE).where(MIGRATION_STATE.c.name == name)
+        ).first()
+    return dict(row._mapping) if row is not None else None
+
+
+def save_migration_state(connection, name, step, rows_done=0) -> None:
+    connection.execute(MIGRATION_STATE.delete().where(MIGRATION_STATE.c.name == name))
+    connection.execute(
+        MIGRATION_STATE.insert().values(
+            name=name,
+            step=step,
+            rows_done=rows_done,
+            updated_at=datetime.datetime.now(),
+        )
+    )
+
+
+def table_columns(sql_engine, table_name) -> dict:
+    # {column name: type} read fresh from the database, {} if the table is missing
+    with sql_engine.connect() as connection:
+        inspector = sa.inspect(connection)
+        if not inspector.has_table(table_name, schema=sql_schema(connection)):
+            return {}
+        return {
+            column["name"]: column["type"]
+            for column in inspector.get_columns(
+                table_name, schema=sql_schema(connection)
+            )
+        }
+
+
+def _quoted(connection, table_name):
+    preparer = connection.dialect.identifier_preparer
+    schema = sql_schema(connection)
+    if schema:
+        return f"{preparer.quote_schema(schema)}.{preparer.quote(table_name)}"
+    return preparer.quote(table_name)
+
+
+def pending_index(sql_engine, table_name, column) -> sa.Index:
+    # filtered index on the rows of table_name whose column is still NULL
+    table = sa.Table(
+        table_name, sa.MetaData(), sa.Column(column), schema=sql_schema(sql_engine)
+    )
+    pending = table.c[column].is_(None)
+    return sa.Index(
+        f"ix_{table_name}_{column}_pending",
+        table.c[column],
+        mssql_where=pending,
+        sqlite_where=pending,
+    )
+
+
+def _online_index_builds(connection) -> bool:
+    if connection.dialect.name != "mssql":
+        return False
+    edition = connection.execute(
+        sa.text("SELECT CAST(SERVERPROPERTY('EngineEdition') AS INT)")
+    ).scalar()
+    return edition in MSSQL_ONLINE_INDEX_EDITIONS
+
+
+def create_pending_index(sql_engine, index) -> None:
+    # built before the first batch, in the one scan of the table the
+    # migration takes; a resumed migration finds it there. An offline build
+    # holds a shared lock on the table that blocks uploads until it is done,
+    # so SQL Server builds it online where the edition allows.
+    with sql_engine.begin() as connection:
+        existing = sa.inspect(connection).get_indexes(
+            index.table.name, schema=index.table.schema
+        )
+        if index.name in {ix["name"] for ix in existing}:
+            return
+        if _online_index_builds(connection):
+            create = sa.schema.CreateIndex(index).compile(dialect=connection.dialect)
+            connection.execute(sa.text(f"{create} WITH (ONLINE = ON)"))
+            return
+        if connection.dialect.name == "mssql":
+            print(
+                f"Building {index.name} offline, uploads to {index.table.name} "
+                "wait until it is built"
+            )
+        index.create(connection)
+
+
+def backfill_in_batches(
+    sql_engine,
+    name,
+    table,
+    values,
+    column,
+    where=None,
+    batch_rows=MIGRATION_BATCH_ROWS,
+) -> int:
+    # UPDATE table SET values on the rows whose column is NULL and that match
+    # where, batch_rows rows per transaction, until a batch comes up short.
+    # Rows written meanwhile are left to the catch-up of the final step.
+    state = migration_state(sql_engine, name)
+    rows_done = 0
+    if state is not None and state["step"] == "backfill":
+        rows_done = state["rows_done"]
+    create_pending_index(sql_engine, pending_index(sql_engine, table.name, column))
+    pending = table.c[column].is_(None)
+    if where is not None:
+        pending = pending & where
+    while True:
+        with sql_engine.begin() as connection:
+            update = table.update().values(values)
+            if connection.dialect.name == "mssql":
+                update = update.where(pending).prefix_with(f"TOP ({int(batch_rows)})")
+            else:
+                # SQLite has no UPDATE ... LIMIT, the batch is picked by rowid
+                rowid = sa.literal_column("rowid")
+                batch = sa.select(rowid).select_from(table).where(pending)
+                update = update.where(rowid.in_(batch.limit(batch_rows)))
+            updated = connection.execute(update).rowcount
+            rows_done += updated
+            save_migration_state(connection, name, "backfill", rows_done)
+        print(f"{name}: {rows_done} rows backfilled")
+        if updated < batch_rows:
+            return rows_done
+
+
+def finish_backfill(connection, table, values, column, where=None) -> int:
+    # in the final transaction: backfill the rows written while the batches
+    # ran and drop the pending index
+    pending = table.c[column].is_(None)
+    if where is not None:
+        pending = pending & where
+    rows_done = connection.execute(
+        table.update().where(pending).values(values)
+    ).rowcount
+    pending_index(connection, table.name, column).drop(connection)
+    return rows_done
+
+
+def add_id_column(
+    sql_engine, table_name="solar_projects", batch_rows=MIGRATION_BATCH_ROWS
+) -> None:
+    # add the upload id column and set it to 0 on the rows that predate it
+    name = f"add_id:{table_name}"
+    columns = table_columns(sql_engine, table_name)
+    if not columns:
+        print(f"{table_name} does not exist yet")
+        return
+    state = migration_state(sql_engine, name)
+    if "id" in columns and (state is None or state["step"] == "done"):
+        return
+    if "id" not in columns:
+        with sql_engine.begin() as connection:
+            connection.execute(
+                sa.text(f"ALTER TABLE {_quoted(connection, table_name)} ADD id INTEGER")
+            )
+            save_migration_state(connection, name, "added")
+    table = sa.table(table_name, sa.column("id"), schema=sql_schema(sql_engine))
+    rows_done = backfill_in_batches(
+        sql_engine, name, table, {"id": 0}, "id", batch_rows=batch_rows
+    )
+    with sql_engine.begin() as connection:
+        rows_done += finish_backfill(connection, table, {"id": 0}, "id")
+        save_migration_state(connection, name, "done", rows_done=rows_done)
+    print(f"{table_name}.id added, {rows_done} existing rows set to 0")
+
+
+def change_column_type(
+    sql_engine, table_name, column, new_type, batch_rows=MIGRATION_BATCH_ROWS
+) -> None:
+    # Retype column through a shadow column: add <column>_new, backfill it
+    # with CAST(column), then catch up, drop the old column and rename the
+    # shadow in one transaction.
+    name = f"retype:{table_name}.{column}"
+    shadow = f"{column}_new"
+    columns = table_columns(sql_engine, table_name)
+    if not columns:
+        print(f"{table_name} does not exist yet")
+        return
+    if column in columns and shadow not in columns:
+        if isinstance(columns[column], new_type):
+            print(f"{table_name}.{column} is already {new_type.__name__}")
+            return
+        with sql_engine.begin() as connection:
+            type_name = new_type().compile(dialect=connection.dialect)
+            connection.execute(
+                sa.text(
+                    f"ALTER TABLE {_quoted(connection, table_name)} "
+                    f"ADD {shadow} {type_name}"
+                )
+            )
+            save_migration_state(connection, name, "added")
+    table = sa.table(
+        table_name, sa.column(column), sa.column(shadow), schema=sql_schema(sql_engine)
+    )
+    # rows whose column is NULL stay NULL, and in the pending index
+    has_value = table.c[column].isnot(None)
+    values = {shadow: sa.cast(table.c[column], new_type)}
+    rows_done = backfill_in_batches(
+        sql_engine, name, table, values, shadow, where=has_value, batch_rows=batch_rows
+    )
+    with sql_engine.begin() as connection:
+        quoted = _quoted(connection, table_name)
+        rows_done += finish_backfill(connection, table, values, shadow, has_value)
+        connection.execute(sa.text(f"ALTER TABLE {quoted} DROP COLUMN {column}"))
+        if connection.dialect.name == "mssql":
+            connection.execute(
+                sa.text(f"EXEC sp_rename '{table_name}.{shadow}', '{column}', 'COLUMN'")
+            )
+        else:
+            connection.execute(
+                sa.text(f"ALTER TABLE {quoted} RENAME COLUMN {shadow} TO {column}")
+            )
+        save_migration_state(connection, name, "done", rows_done=rows_done)
+    print(
+        f"{table_name}.{column} changed to {new_type.__name__}, {rows_done} rows cast"
+    )
+
+
+def run_migrations(sql_engine, batch_rows=MIGRATION_BATCH_ROWS):
+    # bring every project table up to date; each migration is a no-op once done
+    for table_name in SOV_PROJECT_TABLES.values():
+        if not table_columns(sql_engine, table_name):
+            continue
+        add_id_column(sql_engine, table_name, batch_rows=batch_rows)
+        change_column_type(
+            sql_engine,
+            table_name,
+            "Project_Tracker_ID",
+            Integer,
+            batch_rows=batch_rows,
+        )
@@ -0,0 +1,220 @@
+import collections
+import threading
+
+import pandas as pd
+import sqlalchemy as sa
+
+from sov_bulk import sql_schema, sql_transaction
+from sov_to_epcdb import (
+    DATA_VERSION_SEQUENCE,
+    ID_ALLOCATOR,
+    SOV_ITEM_SCHEMAS,
+    SOV_PROJECT_SCHEMAS,
+    SOV_REVISIONS,
+    read_sov_items,
+)
+
+# fetched SOVs kept per database before the least recently used is dropped
+READ_CACHE_ENTRIES = 128
+
+
+class SovReadCache:
+    # LRU of fetched SOVs for one database. Every entry belongs to the data
+    # version it was read at; every committed upload moves the version and
+    # the next lookup starts from an empty cache. A result read at an older
+    # version than the cache has since moved to is not stored. Before the
+    # first upload created the bookkeeping tables there is no version and
+    # nothing is cached.
+
+    def __init__(self, max_entries=READ_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.version = None
+        self.tables = set()
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def sync(self, version, tables) -> None:
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+                self.tables = tables
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value, version) -> None:
+        with self.lock:
+            if version != self.version:
+                return
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.version = None
+
+
+_read_caches = {}
+
+
+def read_cache(sql_engine) -> SovReadCache:
+    return _read_caches.setdefault(str(sql_engine.engine.url), SovReadCache())
+
+
+def data_version(connection, tables):
+    # the count of committed uploads, or None before the first upload
+    # created the bookkeeping tables
+    if ID_ALLOCATOR.name not in tables:
+        return None
+    return connection.execute(
+        sa.select(ID_ALLOCATOR.c.last_id).where(
+            ID_ALLOCATOR.c.name == DATA_VERSION_SEQUENCE
+        )
+    ).scalar()
+
+
+def _union(schemas, tables, where):
+    # one UNION ALL over the existing tables of schemas, each select padded
+    # with NULLs to the columns of all of them and tagged with its sheet
+    columns = list(
+        dict.fromkeys(col.name for table in schemas.values() for col in table.c)
+    )
+    selects = [
+        sa.select(
+            sa.literal(name).label("sheet_name"),
+            *[
+                table.c[col] if col in table.c else sa.null().label(col)
+                for col in columns
+            ],
+        ).where(where(name, table))
+        for name, table in schemas.items()
+        if table.name.lower() in tables
+    ]
+    if not selects:
+        return None
+    return sa.union_all(*selects) if len(selects) > 1 else selects[0]
+
+
+def _split(df, schemas):
+    # the rows of each sheet with only the columns of its own table
+    return {
+        name: part[[col.name for col in schemas[name].c]].reset_index(drop=True)
+        for name, part in df.groupby("sheet_name", sort=False)
+    }
+
+
+def _fetch(connection, tables, header_where):
+    headers = _union(SOV_PROJECT_SCHEMAS, tables, header_where)
+    if headers is None:
+        return {}
+    headers = _split(pd.read_sql_query(headers, connection), SOV_PROJECT_SCHEMAS)
+    ids = {name: int(header["id"].max()) for name, header in headers.items()}
+    if not ids:
+        return {}
+    revisions = set()
+    if SOV_REVISIONS.name in tables:
+        revisions = {
+            (sheet_name, r_id)
+            for sheet_name, r_id in connection.execute(
+                sa.select(SOV_REVISIONS.c.sheet_name, SOV_REVISIONS.c.id).where(
+                    SOV_REVISIONS.c.id.in_(set(ids.values()))
+                )
+            )
+        }
+    items = _union(
+        {name: SOV_ITEM_SCHEMAS[name] for name in ids},
+        tables,
+        lambda name, table: table.c.id == ids[name],
+    )
+    items = (
+        {}
+        if items is None
+        else _split(pd.read_sql_query(items, connection), SOV_ITEM_SCHEMAS)
+    )
+    fetched = {}
+    for name, header in headers.items():
+        if (name, ids[name]) in revisions:
+            # delta revisions are rebuilt from their base revision
+            sheet_items = read_sov_items(connection, name, ids[name])
+        else:
+            sheet_items = items.get(
+                name,
+                pd.DataFrame(columns=[col.name for col in SOV_ITEM_SCHEMAS[name].c]),
+            )
+        fetched[name] = (header, sheet_items)
+    return fetched
+
+
+def _table_names(connection) -> set:
+    return {
+        name.lower()
+        for name in sa.inspect(connection).get_table_names(
+            schema=sql_schema(connection)
+        )
+    }
+
+
+def _cached_fetch(sql_engine, key, header_where, use_cache=True) -> dict:
+    # reads never create or seed tables, so a reader needs no DDL rights
+    cache = read_cache(sql_engine)
+    with sql_transaction(sql_engine) as connection:
+        tables = cache.tables if cache.version is not None else _table_names(connection)
+        version = data_version(connection, tables)
+        if version is None:
+            # no upload yet: read the tables there are, cache nothing
+            cache.clear()
+            use_cache = False
+        elif version != cache.version:
+            tables = _table_names(connection)
+            cache.sync(version, tables)
+        fetched = cache.get(key) if use_cache else None
+        if fetched is None:
+            fetched = _fetch(connection, tables, header_where)
+            # ids reserved for uploads still running are not cached empty
+            if fetched and use_cache:
+                cache.put(key, fetched, version)
+    return {
+        name: (header.copy(), items.copy()) for name, (header, items) in fetched.items()
+    }
+
+
+def fetch_sov(sql_engine, project_id, use_cache=True) -> dict:
+    # {sheet name: (project header, line items)} of every technology uploaded
+    # under project_id
+    project_id = int(project_id)
+    return _cached_fetch(
+        sql_engine,
+        ("id", project_id),
+        lambda name, table: table.c.id == project_id,
+        use_cache=use_cache,
+    )
+
+
+def fetch_latest_sov(sql_engine, project_tracker_id, use_cache=True) -> dict:
+    # the latest revision of each technology of a Project_Tracker_ID, in the
+    # same shape as fetch_sov
+    project_tracker_id = int(project_tracker_id)
+
+    def latest(name, table):
+        # aliased, or the subquery would correlate to the outer table
+        revisions = table.alias()
+        newest = (
+            sa.select(sa.func.max(revisions.c.id))
+            .where(revisions.c.Project_Tracker_ID == project_tracker_id)
+            .scalar_subquery()
+        )
+        return (table.c.Project_Tracker_ID == project_tracker_id) & (
+            table.c.id == newest
+        )
+
+    return _cached_fetch(
+        sql_engine, ("tracker", project_tracker_id), latest, use_cache=use_cache
+    )
@@ -0,0 +1,141 @@
+import datetime
+
+import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table
+
+# Cost benchmark rollup of the line items: one row per technology, cost
+# structure, contractor, stage gate and month submitted. Only additive
+# aggregates are stored (counts, sums, min, max), so each upload is folded in
+# without rescanning the line item tables; an average unit price is
+# Unit_Price_Sum / Priced_Items.
+SUMMARY_KEYS = [
+    "Technology",
+    "Cost_Structure",
+    "Contractor",
+    "Stage_Gate",
+    "Submitted_Month",
+]
+SUMMARY_SUMS = ["Line_Items", "Priced_Items", "Unit_Price_Sum", "Extended_Price_Sum"]
+# key columns are part of the primary key, so missing values are stored as ""
+# and long values are cut to the column width
+SUMMARY_KEY_LENGTHS = {
+    "Technology": 20,
+    "Cost_Structure": 100,
+    "Contractor": 150,
+    "Stage_Gate": 50,
+    "Submitted_Month": 7,
+}
+summary_metadata = MetaData()
+COST_SUMMARY = Table(
+    "sov_cost_summary",
+    summary_metadata,
+    *[
+        Column(key, String(SUMMARY_KEY_LENGTHS[key]), primary_key=True)
+        for key in SUMMARY_KEYS
+    ],
+    Column("Line_Items", Integer, nullable=False),
+    Column("Priced_Items", Integer, nullable=False),
+    Column("Unit_Price_Sum", Float),
+    Column("Unit_Price_Min", Float),
+    Column("Unit_Price_Max", Float),
+    Column("Extended_Price_Sum", Float),
+    Column("Updated_At", DateTime),
+)
+SUMMARY_AGGREGATES = {
+    **{col: "sum" for col in SUMMARY_SUMS},
+    "Unit_Price_Min": "min",
+    "Unit_Price_Max": "max",
+}
+
+
+def summary_month(value) -> str:
+    # "YYYY-MM" of a submission date, "" when there is none
+    value = pd.to_datetime(value, errors="coerce")
+    return "" if pd.isna(value) else value.strftime("%Y-%m")
+
+
+def _key_text(values, key):
+    text = values.map(lambda v: "" if pd.isna(v) else str(v).strip())
+    return text.str[: SUMMARY_KEY_LENGTHS[key]]
+
+
+def summarize_sov_items(items, unit_price) -> pd.DataFrame:
+    # Aggregate line items that carry the key columns into summary rows with
+    # one groupby. Rows without a cost structure (notes, totals) are skipped;
+    # unit prices that are not numbers count as line items but not as priced.
+    keys = pd.DataFrame({key: _key_text(items[key], key) for key in SUMMARY_KEYS})
+    frame = keys.assign(
+        Unit_Price=pd.to_numeric(items[unit_price], errors="coerce"),
+        Extended_Price=pd.to_numeric(items["Extended_Price"], errors="coerce"),
+    )[keys["Cost_Structure"] != ""]
+    return (
+        frame.groupby(SUMMARY_KEYS, sort=False)
+        .agg(
+            Line_Items=("Cost_Structure", "size"),
+            Priced_Items=("Unit_Price", "count"),
+            Unit_Price_Sum=("Unit_Price", "sum"),
+            Unit_Price_Min=("Unit_Price", "min"),
+            Unit_Price_Max=("Unit_Price", "max"),
+            Extended_Price_Sum=("Extended_Price", "sum"),
+        )
+        .reset_index()
+    )
+
+
+def combine_summaries(summaries) -> pd.DataFrame:
+    # fold summary frames of the same shape into one row per key
+    summaries = [summary for summary in summaries if not summary.empty]
+    if not summaries:
+        return pd.DataFrame(columns=SUMMARY_KEYS + list(SUMMARY_AGGREGATES))
+    combined = (
+        pd.concat(summaries, ignore_index=True)
+        .groupby(SUMMARY_KEYS, sort=False)
+        .agg(SUMMARY_AGGREGATES)
+        .reset_index()
+    )
+    return combined.astype({"Line_Items": int, "Priced_Items": int})
+
+
+def merge_cost_summary(connection, summary) -> None:
+    # Fold summary into the stored rows of the same keys, in the caller's
+    # transaction. On SQL Server the stored rows are read with UPDLOCK so two
+    # uploads touching the same key cannot both add to the old totals.
+    if summary.empty:
+        return
+    dimensions = [key for key in SUMMARY_KEYS if key != "Cost_Structure"]
+    columns = [COST_SUMMARY.c[col] for col in SUMMARY_KEYS + list(SUMMARY_AGGREGATES)]
+    stored = []
+    for values, group in summary.groupby(dimensions, sort=False):
+        where = sa.and_(
+            *[COST_SUMMARY.c[key] == value for key, value in zip(dimensions, values)]
+        )
+        cost_structures = group["Cost_Structure"].tolist()
+        for start in range(0, len(cost_structures), 500):
+            matching = where & COST_SUMMARY.c.Cost_Structure.in_(
+                cost_structures[start : start + 500]
+            )
+            rows = connection.execute(
+                sa.select(*columns)
+                .where(matching)
+                .with_hint(COST_SUMMARY, "WITH (UPDLOCK, HOLDLOCK)", "mssql")
+            ).fetchall()
+            stored.append(pd.DataFrame(rows, columns=[col.name for col in columns]))
+            connection.execute(COST_SUMMARY.delete().where(matching))
+    combined = combine_summaries(stored + [summary])
+    combined["Updated_At"] = datetime.datetime.now()
+    records = combined.astype(object).where(combined.notna(), None)
+    connection.execute(COST_SUMMARY.insert(), records.to_dict("records"))
+
+
+def cost_benchmarks(connection, technology=None) -> pd.DataFrame:
+    # the summary rows, of one technology label if given, with the average
+    # unit price worked out
+    query = sa.select(COST_SUMMARY)
+    if technology is not None:
+        query = query.where(COST_SUMMARY.c.Technology == technology)
+    benchmarks = pd.read_sql_query(query, connection)
+    benchmarks["Unit_Price_Avg"] = benchmarks["Unit_Price_Sum"] / benchmarks[
+        "Priced_Items"
+    ].where(benchmarks["Priced_Items"] > 0)
+    return benchmarks
@@ -1,4 +1,17 @@
+import datetime
+import functools
+import glob
+import itertools
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from queue import Queue
+
+import openpyxl
 import pandas as pd
+from openpyxl.cell.cell import ERROR_CODES
 import sqlalchemy as sa
 from sqlalchemy import (
     create_engine,
@@ -13,852 +26,1468 @@ from sqlalchemy import (
     update,
     Float,
     DateTime,
+    Index,
 )
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
 from sqlalchemy.sql import select, func
 import numpy as np
 
+import sov_metrics
+from sov_bulk import (
+    bulk_insert,
+    publish_staged,
+    sql_schema,
+    sql_transaction,
+    stage_frame,
+)
+from sov_cache import file_digest
+from sov_config import as_bool, db_settings, db_url
+from sov_delta import apply_sov_delta, diff_sov_items
+from sov_summary import (
+    COST_SUMMARY,
+    combine_summaries,
+    merge_cost_summary,
+    summarize_sov_items,
+    summary_month,
+)
 
-def upload_solar_sov(sov_sheet, sql_engine, keep_max_id=False) -> None:
-    # upload the metadata
-    readsheetname = "Solar SOV"
-    df_master = pd.read_excel(sov_sheet, sheet_name=readsheetname, header=None)
-    # change the other imports to use master.
-    df = df_master.drop(df_master[df_master.index >= 18].index)
-    df = df.iloc[:, :3]
-    # df.rename(columns={'1': 'ColumnName', '2': 'ColumnValue'}, inplace=True)
-    df.rename(columns={df.columns[1]: "ColumnName"}, inplace=True)
-    df.rename(columns={df.columns[2]: "ColumnValue"}, inplace=True)
-    df.drop(df.columns[[0]], axis=1, inplace=True)
-    df["ColumnValue"] = df["ColumnValue"].astype(str)
-    # test.pivot(index=None, columns='t1',values='t2').bfill().iloc[[0],:]
-    dfpivot = (
-        df.pivot(index=None, columns="ColumnName", values="ColumnValue")
-        .bfill()
-        .iloc[[0], :]
-    )
-    dfpivot.rename(
-        columns={
-            "Project Name": "Project_Name",
-            "Project Tracker ID": "Project_Tracker_ID",
-            "Project Bid Type": "Project_Bid_Type",
-            "Scenario Name": "Scenario_Name",
-            "Scenario ID": "Scenario_ID",
-            "Estimate Source": "Estimate_Source",
-            "Stage Gate": "Stage_Gate",
-            "Milestone": "Milestone",
-            "Design Package": "Design_Package",
-            "EPE Version": "EPE_Version",
-            "Buildable Land Version": "Buildable_Land_Version",
-            "MW DC": "MW_DC",
-            "MW AC": "MW_AC",
-            "Module Count": "Module_Count",
-            "Tracker Row Count": "Tracker_Row_Count",
-            "Labor Type": "Labor_Type",
-            "Contractor": "Contractor",
-            "Date Submitted": "Date_Submitted",
-        },
-        inplace=True,
+# header labels shared by every technology sheet, as (sheet label, column, type)
+SOV_COMMON_HEADER = [
+    ("Project Name", "Project_Name", String),
+    ("Project Tracker ID", "Project_Tracker_ID", Integer),
+    ("Project Bid Type", "Project_Bid_Type", String),
+    ("Scenario Name", "Scenario_Name", String),
+    ("Scenario ID", "Scenario_ID", String),
+    ("Estimate Source", "Estimate_Source", String),
+    ("Stage Gate", "Stage_Gate", String),
+    ("Milestone", "Milestone", String),
+    ("Design Package", "Design_Package", String),
+    ("EPE Version", "EPE_Version", String),
+    ("Buildable Land Version", "Buildable_Land_Version", String),
+]
+SOV_COMMON_ITEMS = [
+    "Cost_Structure",
+    "Description",
+    "Quantity",
+    "U_M",
+    "Unit_Rate",
+    "Extended_Price",
+]
+# Layout of each technology sheet. The header block fills the first
+# header_rows rows with labels in column B and values in column C, the line
+# items start at row items_start (0-based) and end with total_rows total rows.
+# unit_price is the price per unit of capacity the cost summary benchmarks.
+# A new technology only needs an entry here.
+SOV_LAYOUTS = {
+    "Solar SOV": {
+        "label": "Solar",
+        "project_table": "solar_projects",
+        "item_table": "solar_sov",
+        "header_rows": 18,
+        "items_start": 20,
+        "total_rows": 3,
+        "header": SOV_COMMON_HEADER
+        + [
+            ("MW DC", "MW_DC", Float),
+            ("MW AC", "MW_AC", Float),
+            ("Module Count", "Module_Count", Float),
+            ("Tracker Row Count", "Tracker_Row_Count", Float),
+            ("Labor Type", "Labor_Type", String),
+            ("Contractor", "Contractor", String),
+            ("Date Submitted", "Date_Submitted", DateTime),
+        ],
+        "items": SOV_COMMON_ITEMS + ["Price_per_Wp", "Comments", "Typical_Inclusions"],
+        "unit_price": "Price_per_Wp",
+    },
+    "HV SOV": {
+        "label": "HV",
+        "project_table": "HV_projects",
+        "item_table": "HV_sov",
+        "header_rows": 16,
+        "items_start": 18,
+        "total_rows": 2,
+        "header": SOV_COMMON_HEADER
+        + [
+            ("MW AC", "MW_AC", Float),
+            ("Interconnect Voltage", "Interconnect_Voltage", Float),
+            ("Labor Type", "Labor_Type", String),
+            ("Contractor", "Contractor", String),
+            ("Date Submitted", "Date_Submitted", DateTime),
+        ],
+        "items": SOV_COMMON_ITEMS + ["Price_per_kW", "Comments"],
+        "unit_price": "Price_per_kW",
+    },
+    "Storage SOV": {
+        "label": "Storage",
+        "project_table": "storage_projects",
+        "item_table": "storage_sov",
+        "header_rows": 22,
+        "items_start": 24,
+        "total_rows": 2,
+        "header": SOV_COMMON_HEADER
+        + [
+            ("BESS OEM", "BESS_OEM", String),
+            ("Product Type", "Product_Type", String),
+            ("Coupling", "Coupling", String),
+            ("Battery Size at POI(MW)", "Battery_Size_at_POI(MW)", Float),
+            ("Discharge Duration(hr)", "Discharge_Duration(hr)", String),
+            ("MWh Installed", "MWh_Installed", Float),
+            ("BESS Container Quantity", "BESS_Container_Quantity", Float),
+            ("PCS Quantity", "PCS_Quantity", Float),
+            ("Labor (Union/Prevailing/Non-Union)", "Labor_Type", String),
+            ("Contractor", "Contractor", String),
+            ("Date Submitted", "Date_Submitted", DateTime),
+        ],
+        "items": SOV_COMMON_ITEMS + ["Price_per_kWh", "Comments"],
+        "unit_price": "Price_per_kWh",
+    },
+}
+# technology sheets in the order they are uploaded from a combined workbook
+SOV_SHEET_NAMES = list(SOV_LAYOUTS)
+SOV_PROJECT_TABLES = {
+    name: layout["project_table"] for name, layout in SOV_LAYOUTS.items()
+}
+SOV_ITEM_TABLES = {name: layout["item_table"] for name, layout in SOV_LAYOUTS.items()}
+# leading columns holding the header key/value block and the line items
+SOV_SHEET_COLUMNS = {
+    name: max(3, len(layout["items"])) for name, layout in SOV_LAYOUTS.items()
+}
+# Declared definitions of the project and line item tables, built once from
+# the layouts. Uploads create the tables a database lacks from them, and
+# they type the inserts and validate frames before an upload. Line item
+# cells mix numbers and text ("TBD", "LS"), so the parser hands them over as
+# text and they are stored as text like the original HV_sov table.
+# Uploads look up the latest id of a Project_Tracker_ID and readers fetch or
+# join line items by id, so the project tables are indexed on
+# (Project_Tracker_ID, id), which covers MAX(id) per project, and on id, and
+# the line item tables on id.
+sov_metadata = MetaData()
+SOV_PROJECT_SCHEMAS = {
+    name: Table(
+        layout["project_table"],
+        sov_metadata,
+        *[Column(column, column_type) for _, column, column_type in layout["header"]],
+        Column("id", Integer),
+        Index(f"ix_{layout['project_table']}_tracker_id", "Project_Tracker_ID", "id"),
+        Index(f"ix_{layout['project_table']}_id", "id"),
     )
-    metadata = MetaData()
-    table_name = "solar_projects"
-    # Make sure that the Column names and types match with your DataFrame's columns
-    table = Table(
-        table_name,
-        metadata,
-        Column("Project_Name", String),
-        Column("Project_Tracker_ID", Integer),
-        Column("Project_Bid_Type", String),
-        Column("Scenario_Name", String),
-        Column("Scenario_ID", String),
-        Column("Estimate_Source", String),
-        Column("Stage_Gate", String),
-        Column("Milestone", String),
-        Column("Design_Package", String),
-        Column("EPE_Version", String),
-        Column("Buildable_Land_Version", String),
-        Column("MW_DC", Float),
-        Column("MW_AC", Float),
-        Column("Module_Count", Float),
-        Column("Tracker_Row_Count", Float),
-        Column("Labor_Type", String),
-        Column("Contractor", String),
-        Column("Date_Submitted", DateTime),
+    for name, layout in SOV_LAYOUTS.items()
+}
+SOV_ITEM_SCHEMAS = {
+    name: Table(
+        layout["item_table"],
+        sov_metadata,
+        *[Column(column, String) for column in layout["items"]],
         Column("id", Integer),
+        Index(f"ix_{layout['item_table']}_id", "id"),
     )
-    max_id = get_max_id(sql_engine)
-    if max_id is None:
-        max_id = 0
-    if keep_max_id:
-        r_id = max_id
-    else:
-        r_id = max_id + 1
-    droplist = dfpivot.columns.astype(str) == "nan"
-    if droplist.any():
-        dfpivot.drop(
-            dfpivot.columns[[i for i, drop in enumerate(droplist) if drop]],
-            axis=1,
-            inplace=True,
+    for name, layout in SOV_LAYOUTS.items()
+}
+SOV_PROJECT_DTYPES = {
+    name: {column.name: column.type for column in table.columns}
+    for name, table in SOV_PROJECT_SCHEMAS.items()
+}
+# empty rows after the cost table at which the streaming reader stops
+SOV_BLANK_ROW_LIMIT = 50
+# line item rows per insert when uploading in chunks
+SOV_CHUNK_ROWS = 5000
+# bump whenever parse_*_sov output changes so cached parses are not reused
+SOV_PARSE_VERSION = 6
+
+# bookkeeping tables owned by this module, created on first use
+bookkeeping_metadata = MetaData()
+# project ids are shared by the solar, HV and storage tables and handed out
+# from a single row of this allocation table
+PROJECT_ID_SEQUENCE = "project"
+# a second row counts the committed uploads; every upload moves it in its own
+# transaction, so readers can tell their cached SOVs are stale
+DATA_VERSION_SEQUENCE = "data_version"
+ID_ALLOCATOR = Table(
+    "sov_id_allocator",
+    bookkeeping_metadata,
+    Column("name", String(50), primary_key=True),
+    Column("last_id", Integer, nullable=False),
+)
+# one row per uploaded workbook sheet, keyed by the workbook's content hash
+INGEST_LEDGER = Table(
+    "sov_ingest_ledger",
+    bookkeeping_metadata,
+    Column("content_hash", String(64), primary_key=True),
+    Column("sheet_name", String(50), primary_key=True),
+    Column("id", Integer, nullable=False),
+    Column("source", String(260)),
+    Column("ingested_at", DateTime),
+)
+# delta revisions store only their changes against base_id
+SOV_REVISIONS = Table(
+    "sov_revisions",
+    bookkeeping_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("sheet_name", String(50), primary_key=True),
+    Column("base_id", Integer, nullable=False),
+)
+# engines whose database is known to have the tables; keyed on the engine
+# object, as two in-memory SQLite engines share a url but not a database
+_bookkeeping_ready = weakref.WeakSet()
+_sov_tables_ready = weakref.WeakSet()
+_engines = {}
+
+
+def _header_text(value):
+    return str(value)
+
+
+def _header_float(value):
+    if isinstance(value, str):
+        value = value.replace(",", "").strip()
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(number) else number
+
+
+def _header_integer(value):
+    number = _header_float(value)
+    if number is None or not number.is_integer():
+        return None
+    return int(number)
+
+
+def _header_datetime(value):
+    try:
+        timestamp = pd.to_datetime(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return None if pd.isna(timestamp) else timestamp.to_pydatetime()
+
+
+def _item_text(value):
+    # line item cells are stored as text; whole-number floats are written as
+    # the integers the sheet shows, whichever reader produced them
+    if pd.isna(value):
+        return pd.NA
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+# header cell converters by the column type declared in the layout
+SOV_HEADER_CONVERTERS = {
+    String: _header_text,
+    Integer: _header_integer,
+    Float: _header_float,
+    DateTime: _header_datetime,
+}
+
+
+class SovSheetParser:
+    # Parser of one sheet layout. The renames and header types are worked
+    # out once; calling it on a whole sheet cuts out each block by position
+    # in a single step, and the header and line item steps can also be run
+    # on their own for chunked reading.
+
+    def __init__(self, layout):
+        self.label = layout["label"]
+        self.header_rows = layout["header_rows"]
+        self.items_start = layout["items_start"]
+        self.total_rows = layout["total_rows"]
+        self.header_columns = {
+            label: (column, SOV_HEADER_CONVERTERS[column_type], column_type)
+            for label, column, column_type in layout["header"]
+        }
+        self.item_columns = list(layout["items"])
+
+    def header(self, pairs):
+        # the (label, value) rows become one record of native values; labels
+        # the layout does not know are kept as text
+        with sov_metrics.stage("header"):
+            return self._header(pairs)
+
+    def _header(self, pairs):
+        record = {}
+        for label, value in pairs:
+            # blank labels are spacer rows; a repeated label keeps its first value
+            if pd.isna(label):
+                continue
+            column, convert, column_type = self.header_columns.get(
+                label, (label, _header_text, String)
+            )
+            if column in record:
+                continue
+            record[column] = None if pd.isna(value) else convert(value)
+            if record[column] is None and not pd.isna(value):
+                message = (
+                    f"{self.label} {label} value {value!r} is not a valid "
+                    f"{column_type.__name__}"
+                )
+                # uploads are matched to their project by tracker id, so a
+                # sheet without one is rejected before an id is allocated
+                if column == "Project_Tracker_ID":
+                    raise ValueError(message)
+                print(f"{message}, stored as NULL")
+        if record.get("Project_Tracker_ID") is None:
+            raise ValueError(f"{self.label} sheet has no Project Tracker ID")
+        return pd.DataFrame([record])
+
+    def items(self, df, totals=True):
+        # sheets read with header=None are labelled by column position
+        with sov_metrics.stage("transform"):
+            df = df.reindex(columns=range(len(self.item_columns)))
+            df.columns = self.item_columns
+            if totals:
+                # the total rows have no cost structure but are kept
+                df.iloc[-self.total_rows :, 0] = ""
+            return df[df.Cost_Structure.notnull()].applymap(_item_text)
+
+    def __call__(self, df_master):
+        dfpivot = self.header(
+            df_master.iloc[: self.header_rows, [1, 2]].values.tolist()
         )
-    dfpivot["id"] = r_id
-    # uploads the project
-    dfpivot.to_sql(
-        con=sql_engine,
-        schema="dbo",
-        name="solar_projects",
-        if_exists="append",
-        index=False,
-        dtype={
-            "Project_Name": String,
-            "Project_Tracker_ID": Integer,
-            "Project_Bid_Type": String,
-            "Scenario_Name": String,
-            "Scenario_ID": String,
-            "Estimate_Source": String,
-            "Stage_Gate": String,
-            "Milestone": String,
-            "Design_Package": String,
-            "EPE_Version": String,
-            "Buildable_Land_Version": String,
-            "MW_DC": Float,
-            "MW_AC": Float,
-            "Module_Count": Float,
-            "Tracker_Row_Count": Float,
-            "Labor_Type": String,
-            "Contractor": String,
-            "Date_Submitted": DateTime,
-            "id": Integer,
-        },
-    )
-    # upload the costing
-    # selects the first of the equivalent project ids, should be the last updated
-    Project_Tracker_ID = dfpivot["Project_Tracker_ID"][0]
-    query = text(
-        """select id from  solar_projects where Project_Tracker_ID = {}""".format(
-            Project_Tracker_ID, "{}"
+        return dfpivot, self.items(df_master.iloc[self.items_start :])
+
+
+SOV_PARSERS = {name: SovSheetParser(layout) for name, layout in SOV_LAYOUTS.items()}
+
+
+def validate_sov_frame(df, table) -> None:
+    # every column must exist in the table, and numeric or date columns must
+    # hold values of that kind
+    unknown = [col for col in df.columns if col not in table.c]
+    if unknown:
+        raise ValueError(f"Columns {unknown} are not in table {table.name}")
+    for col in df.columns:
+        values = df[col].dropna()
+        if values.empty:
+            continue
+        column_type = table.c[col].type
+        if isinstance(column_type, (Integer, Float)):
+            valid = pd.api.types.is_numeric_dtype(values)
+        elif isinstance(column_type, DateTime):
+            valid = pd.api.types.is_datetime64_any_dtype(values)
+        elif isinstance(column_type, String):
+            valid = values.map(lambda value: isinstance(value, str)).all()
+        else:
+            continue
+        if not valid:
+            raise ValueError(
+                f"Column {col} of table {table.name} expects {column_type}, "
+                f"got {values.dtype}"
+            )
+
+
+def known_sheet_id(sql_engine, content_hash, readsheetname, sov_sheet):
+    # the id this exact sheet was already uploaded under, if any
+    ingested = ingested_ids(sql_engine, [content_hash]).get(content_hash, {})
+    if readsheetname in ingested:
+        print(
+            f"{SOV_LAYOUTS[readsheetname]['label']} {sov_sheet} already uploaded "
+            f"as id {ingested[readsheetname]}, skipping"
         )
-    )
-    df = pd.read_sql_query(query, sql_engine)
-    rid = df["id"].to_list()[-1]
-    print(f"Solar Upload ID: {rid}, options: {df['id'].iloc[:]}")
-    print(f"Solar Upload ID: {r_id}")
-    df = df_master.drop(df_master[df_master.index <= 19].index)
-    df.rename(columns={df.columns[0]: "Cost_Structure"}, inplace=True)
-    df.rename(columns={df.columns[1]: "Description"}, inplace=True)
-    df.rename(columns={df.columns[2]: "Quantity"}, inplace=True)
-    df.rename(columns={df.columns[3]: "U_M"}, inplace=True)
-    df.rename(columns={df.columns[4]: "Unit_Rate"}, inplace=True)
-    df.rename(columns={df.columns[5]: "Extended_Price"}, inplace=True)
-    df.rename(columns={df.columns[6]: "Price_per_Wp"}, inplace=True)
-    df.rename(columns={df.columns[7]: "Comments"}, inplace=True)
-    df.rename(columns={df.columns[8]: "Typical_Inclusions"}, inplace=True)
-    df.iloc[-3:, df.columns.get_loc("Cost_Structure")] = ""
-    df.loc[:, "id"] = r_id
-    df = df[df.Cost_Structure.notnull()]
-    df.fillna(value=pd.NA, inplace=True)
-    df.to_sql(
-        con=sql_engine, schema="dbo", name="solar_sov", if_exists="append", index=False
-    )
-    print(f"Solar {sov_sheet} successfully uploaded to Database")
+        sov_metrics.annotate(status="skipped", id=ingested[readsheetname])
+    return ingested.get(readsheetname)
 
 
-def upload_hv_sov(sov_sheet, sql_engine, keep_max_id=False) -> None:
-    # upload the metadata
-    readsheetname = "HV SOV"
-    df_master = pd.read_excel(sov_sheet, sheet_name=readsheetname, header=None)
-    # change the other imports to use master.
-    df = df_master.drop(df_master[df_master.index >= 16].index)
-    df = df.iloc[:, :3]
-    # df.rename(columns={'1': 'ColumnName', '2': 'ColumnValue'}, inplace=True)
-    df.rename(columns={df.columns[1]: "ColumnName"}, inplace=True)
-    df.rename(columns={df.columns[2]: "ColumnValue"}, inplace=True)
-    df.drop(df.columns[[0]], axis=1, inplace=True)
-    df["ColumnValue"] = df["ColumnValue"].astype(str)
-    # test.pivot(index=None, columns='t1',values='t2').bfill().iloc[[0],:]
-    dfpivot = (
-        df.pivot(index=None, columns="ColumnName", values="ColumnValue")
-        .bfill()
-        .iloc[[0], :]
-    )
-    dfpivot.rename(
-        columns={
-            "Project Name": "Project_Name",
-            "Project Tracker ID": "Project_Tracker_ID",
-            "Project Bid Type": "Project_Bid_Type",
-            "Scenario Name": "Scenario_Name",
-            "Scenario ID": "Scenario_ID",
-            "Estimate Source": "Estimate_Source",
-            "Stage Gate": "Stage_Gate",
-            "Milestone": "Milestone",
-            "Design Package": "Design_Package",
-            "EPE Version": "EPE_Version",
-            "Buildable Land Version": "Buildable_Land_Version",
-            "MW DC": "MW_DC",
-            "MW AC": "MW_AC",
-            "Module Count": "Module_Count",
-            "Tracker Row Count": "Tracker_Row_Count",
-            "Labor Type": "Labor_Type",
-            "Contractor": "Contractor",
-            "Date Submitted": "Date_Submitted",
-        },
-        inplace=True,
-    )
-    metadata = MetaData()
-    table_name = "HV_projects"
-    # Make sure that the Column names and types match with your DataFrame's columns
-    table = Table(
-        table_name,
-        metadata,
-        Column("Project_Name", String),
-        Column("Project_Tracker_ID", Integer),
-        Column("Project_Bid_Type", String),
-        Column("Scenario_Name", String),
-        Column("Scenario_ID", String),
-        Column("Estimate_Source", String),
-        Column("Stage_Gate", String),
-        Column("Milestone", String),
-        Column("Design_Package", String),
-        Column("EPE_Version", String),
-        Column("Buildable_Land_Version", String),
-        Column("MW_AC", Float),
-        Column("Interconnect_Voltage", Float),
-        Column("Labor_Type", String),
-        Column("Contractor", String),
-        Column("Date_Submitted", DateTime),
-        Column("id", Integer),
-    )
-    max_id = get_max_id(sql_engine)
-    if max_id is None:
-        max_id = 0
-    if keep_max_id:
-        r_id = max_id
-    else:
-        r_id = max_id + 1
-    droplist = dfpivot.columns.astype(str) == "nan"
-    if droplist.any():
-        dfpivot.drop(
-            dfpivot.columns[[i for i, drop in enumerate(droplist) if drop]],
-            axis=1,
-            inplace=True,
+def resolve_project_id(sql_engine, project_id=None, keep_max_id=False) -> int:
+    if project_id is not None:
+        return project_id
+    with sov_metrics.stage("allocate_id"):
+        if keep_max_id:
+            return current_project_id(sql_engine)
+        return allocate_ids(sql_engine)
+
+
+def insert_project_row(connection, readsheetname, dfpivot) -> None:
+    with sov_metrics.stage("project_insert"):
+        dfpivot.to_sql(
+            con=connection,
+            schema=sql_schema(connection),
+            name=SOV_PROJECT_TABLES[readsheetname],
+            if_exists="append",
+            index=False,
+            dtype=SOV_PROJECT_DTYPES[readsheetname],
         )
-    dfpivot["id"] = r_id
-    # uploads the project
-    dfpivot.to_sql(
-        con=sql_engine,
-        schema="dbo",
-        name="HV_projects",
-        if_exists="append",
-        index=False,
-        dtype={
-            "Project_Name": String,
-            "Project_Tracker_ID": Integer,
-            "Project_Bid_Type": String,
-            "Scenario_Name": String,
-            "Scenario_ID": String,
-            "Estimate_Source": String,
-            "Stage_Gate": String,
-            "Milestone": String,
-            "Design_Package": String,
-            "EPE_Version": String,
-            "Buildable_Land_Version": String,
-            "MW_AC": Float,
-            "Interconnect_Voltage": Float,
-            "Labor_Type": String,
-            "Contractor": String,
-            "Date_Submitted": DateTime,
-            "id": Integer,
-        },
-    )
-    # upload the costing
-    # selects the first of the equivalent project ids, should be the last updated
-    Project_Tracker_ID = dfpivot["Project_Tracker_ID"][0]
-    query = text(
-        """select id from  HV_projects where Project_Tracker_ID = {}""".format(
-            Project_Tracker_ID, "{}"
+    sov_metrics.count("rows_written", len(dfpivot))
+
+
+def stage_sov_items(connection, readsheetname, df, staged=None):
+    # load line items into a session staging table ahead of the write that
+    # publishes them, so the live table is only locked for that one statement
+    with sov_metrics.stage("items_stage"):
+        staged = stage_frame(
+            df,
+            SOV_ITEM_TABLES[readsheetname],
+            connection,
+            schema=sql_schema(connection),
+            staged=staged,
         )
-    )
-    df = pd.read_sql_query(query, sql_engine)
-    rid = df["id"].to_list()[-1]
-    print(f"HV Upload ID: {rid}, options: {df['id'].iloc[:]}")
-    print(f"HV Upload ID: {r_id}")
-    df = df_master.drop(df_master[df_master.index <= 17].index)
-    df.rename(columns={df.columns[0]: "Cost_Structure"}, inplace=True)
-    df.rename(columns={df.columns[1]: "Description"}, inplace=True)
-    df.rename(columns={df.columns[2]: "Quantity"}, inplace=True)
-    df.rename(columns={df.columns[3]: "U_M"}, inplace=True)
-    df.rename(columns={df.columns[4]: "Unit_Rate"}, inplace=True)
-    df.rename(columns={df.columns[5]: "Extended_Price"}, inplace=True)
-    df.rename(columns={df.columns[6]: "Price_per_kW"}, inplace=True)
-    df.rename(columns={df.columns[7]: "Comments"}, inplace=True)
-    df.iloc[-2:, df.columns.get_loc("Cost_Structure")] = ""
-    df.loc[:, "id"] = r_id
-    df = df[df.Cost_Structure.notnull()]
-    df.fillna(value=pd.NA, inplace=True)
-    df.to_sql(
-        con=sql_engine, schema="dbo", name="HV_sov", if_exists="append", index=False
-    )
-    print(f"HV {sov_sheet} successfully uploaded to Database")
+    sov_metrics.count("rows_written", len(df))
+    return staged
 
 
-def upload_storage_sov(sov_sheet, sql_engine, keep_max_id=False) -> None:
+@sov_metrics.traced("upload_sheet")
+def upload_sov_sheet(
+    sov_sheet,
+    readsheetname,
+    sql_engine,
+    keep_max_id=False,
+    parsed=None,
+    parse_cache=None,
+    bulk_method="multi",
+    project_id=None,
+    skip_duplicates=True,
+    content_hash=None,
+    delta=False,
+    staged=None,
+) -> int:
     # upload the metadata
-    readsheetname = "Storage SOV"
-    df_master = pd.read_excel(sov_sheet, sheet_name=readsheetname, header=None)
-    # change the other imports to use master.
-    df = df_master.drop(df_master[df_master.index >= 22].index)
-    df = df.iloc[:, :3]
-    # df.rename(columns={'1': 'ColumnName', '2': 'ColumnValue'}, inplace=True)
-    df.rename(columns={df.columns[1]: "ColumnName"}, inplace=True)
-    df.rename(columns={df.columns[2]: "ColumnValue"}, inplace=True)
-    df.drop(df.columns[[0]], axis=1, inplace=True)
-    df["ColumnValue"] = df["ColumnValue"].astype(str)
-    # test.pivot(index=None, columns='t1',values='t2').bfill().iloc[[0],:]
-    dfpivot = (
-        df.pivot(index=None, columns="ColumnName", values="ColumnValue")
-        .bfill()
-        .iloc[[0], :]
-    )
-    dfpivot.rename(
-        columns={
-            "Project Name": "Project_Name",
-            "Project Tracker ID": "Project_Tracker_ID",
-            "Project Bid Type": "Project_Bid_Type",
-            "Scenario Name": "Scenario_Name",
-            "Scenario ID": "Scenario_ID",
-            "Estimate Source": "Estimate_Source",
-            "Stage Gate": "Stage_Gate",
-            "Milestone": "Milestone",
-            "Design Package": "Design_Package",
-            "EPE Version": "EPE_Version",
-            "Buildable Land Version": "Buildable_Land_Version",
-            "BESS OEM": "BESS_OEM",
-            "Product Type": "Product_Type",
-            "Coupling": "Coupling",
-            "Battery Size at POI(MW)": "Battery_Size_at_POI(MW)",
-            "Discharge Duration(hr)": "Discharge_Duration(hr)",
-            "MWh Installed": "MWh_Installed",
-            "BESS Container Quantity": "BESS_Container_Quantity",
-            "PCS Quantity": "PCS_Quantity",
-            "Labor (Union/Prevailing/Non-Union)": "Labor_Type",
-            "Contractor": "Contractor",
-            "Date Submitted": "Date_Submitted",
-        },
-        inplace=True,
-    )
-    metadata = MetaData()
-    table_name = "Storage_projects"
-    # Make sure that the Column names and types match with your DataFrame's columns
-    table = Table(
-        table_name,
-        metadata,
-        Column("Project_Name", String),
-        Column("Project_Tracker_ID", Integer),
-        Column("Project_Bid_Type", String),
-        Column("Scenario_Name", String),
-        Column("Scenario_ID", String),
-        Column("Estimate_Source", String),
-        Column("Stage_Gate", String),
-        Column("Milestone", String),
-        Column("Design_Package", String),
-        Column("EPE_Version", String),
-        Column("Buildable_Land_Version", String),
-        Column("BESS_OEM", String),
-        Column("Product_Type", String),
-        Column("Coupling", String),
-        Column("Battery_Size_at_POI(MW)", Float),
-        Column("Discharge_Duration(hr)", String),
-        Column("MWh_Installed", Float),
-        Column("BESS_Container_Quantity", Float),
-        Column("PCS_Quantity", Float),
-        Column("Labor_Type", String),
-        Column("Contractor", String),
-        Column("Date_Submitted", DateTime),
-        Column("id", Integer),
-    )
-    max_id = get_max_id(sql_engine)
-    if max_id is None:
-        max_id = 0
-    if keep_max_id:
-        r_id = max_id
-    else:
-        r_id = max_id + 1
-    droplist = dfpivot.columns.astype(str) == "nan"
-    if droplist.any():
-        dfpivot.drop(
-            dfpivot.columns[[i for i, drop in enumerate(droplist) if drop]],
-            axis=1,
-            inplace=True,
+    label = SOV_LAYOUTS[readsheetname]["label"]
+    # a caller passing content_hash has already checked the ledger
+    if content_hash is None:
+        content_hash = file_digest(sov_sheet)
+        known_id = skip_duplicates and known_sheet_id(
+            sql_engine, content_hash, readsheetname, sov_sheet
         )
+        if known_id:
+            return known_id
+    if parsed is None:
+        parsed = parse_sov_sheet(
+            sov_sheet,
+            readsheetname,
+            parse_cache=parse_cache,
+            content_hash=content_hash,
+        )
+    dfpivot, df_items = parsed
+    dfpivot = dfpivot.copy()
+    # reject frames the tables cannot hold before an id is spent on them
+    validate_sov_frame(dfpivot, SOV_PROJECT_SCHEMAS[readsheetname])
+    validate_sov_frame(df_items, SOV_ITEM_SCHEMAS[readsheetname])
+    r_id = resolve_project_id(sql_engine, project_id, keep_max_id)
+    sov_metrics.annotate(id=r_id, sheets=[readsheetname])
     dfpivot["id"] = r_id
-    # uploads the project
-    dfpivot.to_sql(
-        con=sql_engine,
-        schema="dbo",
-        name="Storage_projects",
-        if_exists="append",
-        index=False,
-        dtype={
-            "Project_Name": String,
-            "Project_Tracker_ID": Integer,
-            "Project_Bid_Type": String,
-            "Scenario_Name": String,
-            "Scenario_ID": String,
-            "Estimate_Source": String,
-            "Stage_Gate": String,
-            "Milestone": String,
-            "Design_Package": String,
-            "EPE_Version": String,
-            "Buildable_Land_Version": String,
-            "BESS_OEM": String,
-            "Product_Type": String,
-            "Coupling": String,
-            "Battery_Size_at_POI(MW)": Float,
-            "Discharge_Duration(hr)": String,
-            "MWh_Installed": Float,
-            "BESS_Container_Quantity": Float,
-            "PCS_Quantity": Float,
-            "Labor_Type": String,
-            "Contractor": String,
-            "Date_Submitted": DateTime,
-            "id": Integer,
-        },
-    )
-    # upload the costing
-    # selects the first of the equivalent project ids, should be the last updated
-    Project_Tracker_ID = dfpivot["Project_Tracker_ID"][0]
-    query = text(
-        """select id from  storage_projects where Project_Tracker_ID = {}""".format(
-            Project_Tracker_ID, "{}"
+    df = df_items.assign(id=r_id)
+    ensure_sov_tables(sql_engine)
+    # the project row and its line items commit or roll back together
+    with sql_transaction(sql_engine) as connection:
+        if bulk_method == "merge" and not delta and staged is None:
+            staged = stage_sov_items(connection, readsheetname, df)
+        # uploads the project
+        insert_project_row(connection, readsheetname, dfpivot)
+        # upload the costing under the id the project row was written with
+        print(f"{label} Upload ID: {r_id}")
+        write_sov_items(
+            connection,
+            readsheetname,
+            df,
+            r_id,
+            dfpivot["Project_Tracker_ID"].iloc[0],
+            bulk_method=bulk_method,
+            delta=delta,
+            staged=staged,
         )
+        update_cost_summary(
+            connection, summarize_upload(readsheetname, dfpivot, df_items)
+        )
+        record_ingest(
+            connection,
+            content_hash,
+            readsheetname,
+            r_id,
+            sov_sheet,
+            replace=not skip_duplicates,
+        )
+    print(f"{label} {sov_sheet} successfully uploaded to Database")
+    return r_id
+
+
+def summarize_upload(readsheetname, dfpivot, df_items):
+    # cost summary rows of a sheet's line items under its header's keys
+    header = dfpivot.iloc[0]
+    return summarize_sov_items(
+        df_items.assign(
+            Technology=SOV_LAYOUTS[readsheetname]["label"],
+            Contractor=header.get("Contractor"),
+            Stage_Gate=header.get("Stage_Gate"),
+            Submitted_Month=summary_month(header.get("Date_Submitted")),
+        ),
+        SOV_LAYOUTS[readsheetname]["unit_price"],
     )
-    df = pd.read_sql_query(query, sql_engine)
-    rid = df["id"].to_list()[-1]
-    print(f"Storage Upload ID: {rid}, options: {df['id'].iloc[:]}")
-    print(f"Storage Upload ID: {r_id}")
-    df = df_master.drop(df_master[df_master.index <= 23].index)
-    df.rename(columns={df.columns[0]: "Cost_Structure"}, inplace=True)
-    df.rename(columns={df.columns[1]: "Description"}, inplace=True)
-    df.rename(columns={df.columns[2]: "Quantity"}, inplace=True)
-    df.rename(columns={df.columns[3]: "U_M"}, inplace=True)
-    df.rename(columns={df.columns[4]: "Unit_Rate"}, inplace=True)
-    df.rename(columns={df.columns[5]: "Extended_Price"}, inplace=True)
-    df.rename(columns={df.columns[6]: "Price_per_kWh"}, inplace=True)
-    df.rename(columns={df.columns[7]: "Comments"}, inplace=True)
-    df.iloc[-2:, df.columns.get_loc("Cost_Structure")] = ""
-    df.loc[:, "id"] = r_id
-    df = df[df.Cost_Structure.notnull()]
-    df.fillna(value=pd.NA, inplace=True)
-    df.to_sql(
-        con=sql_engine,
-        schema="dbo",
-        name="storage_sov",
-        if_exists="append",
-        index=False,
-    )
-    print(f"Storage {sov_sheet} successfully uploaded to Database")
 
 
-def change_projid_to_integer(sql_engine):
-    metadata = MetaData()
+def update_cost_summary(connection, summary) -> None:
+    ensure_bookkeeping_tables(connection)
+    with sov_metrics.stage("summary"):
+        merge_cost_summary(connection, summary)
 
-    # reflect the table
-    table = Table("solar_projects", metadata, autoload_with=sql_engine)
 
-    # create new column
-    new_column = Column("Project_Tracker_ID_int", Integer, nullable=True)
-    table.append_column(new_column)
+def iter_sov_item_chunks(
+    rows, parser, chunk_rows=SOV_CHUNK_ROWS, blank_row_limit=SOV_BLANK_ROW_LIMIT
+):
+    # transformed line item frames of at most chunk_rows rows from raw sheet
+    # rows. The last total_rows rows are held back until the table ends, as
+    # only then is it known that they are the total rows. Chunks keep the
+    # cells as read, like a full read, instead of inferring a dtype per chunk.
+    width = len(parser.item_columns)
+    held = []
+    blank_rows = 0
+    # reading time is taken between chunks so it excludes the consumer's work
+    started = time.perf_counter()
+    for row in rows:
+        row = [_stream_cell(value) for value in row]
+        if all(pd.isna(value) for value in row):
+            blank_rows += 1
+            if blank_rows >= blank_row_limit:
+                break
+            continue
+        held.extend([[np.nan] * width] * blank_rows)
+        held.append(row + [np.nan] * (width - len(row)))
+        blank_rows = 0
+        if len(held) >= chunk_rows + parser.total_rows:
+            sov_metrics.add_stage_time("read", time.perf_counter() - started)
+            yield parser.items(
+                pd.DataFrame(held[:chunk_rows], dtype=object), totals=False
+            )
+            del held[:chunk_rows]
+            started = time.perf_counter()
+    sov_metrics.add_stage_time("read", time.perf_counter() - started)
+    if held:
+        yield parser.items(pd.DataFrame(held, dtype=object))
 
-    # add new column to the database
-    with sql_engine.begin() as connection:
-        connection.execute(
-            "ALTER TABLE solar_projects ADD Project_Tracker_ID_int INTEGER"
-        )
 
-    # copy and cast data from the old column to the new one
-    with sql_engine.begin() as connection:
-        connection.execute(
-            text(
-                "UPDATE solar_projects SET Project_Tracker_ID_int = CAST(Project_Tracker_ID AS INTEGER)"
+@sov_metrics.traced("upload_sheet")
+def upload_sov_sheet_chunked(
+    sov_sheet,
+    readsheetname,
+    sql_engine,
+    keep_max_id=False,
+    chunk_rows=SOV_CHUNK_ROWS,
+    bulk_method="multi",
+    project_id=None,
+    skip_duplicates=True,
+    content_hash=None,
+    worksheet=None,
+) -> int:
+    # Streams the sheet with the read-only reader and inserts the line items
+    # chunk_rows at a time, so memory is bounded by the chunk size instead of
+    # the sheet. Everything is still written in one transaction.
+    label = SOV_LAYOUTS[readsheetname]["label"]
+    if content_hash is None:
+        content_hash = file_digest(sov_sheet)
+        known_id = skip_duplicates and known_sheet_id(
+            sql_engine, content_hash, readsheetname, sov_sheet
+        )
+        if known_id:
+            return known_id
+    if worksheet is None:
+        workbook = open_sov_workbook(sov_sheet)
+        try:
+            return upload_sov_sheet_chunked(
+                sov_sheet,
+                readsheetname,
+                sql_engine,
+                keep_max_id=keep_max_id,
+                chunk_rows=chunk_rows,
+                bulk_method=bulk_method,
+                project_id=project_id,
+                skip_duplicates=skip_duplicates,
+                content_hash=content_hash,
+                worksheet=workbook[readsheetname],
             )
+        finally:
+            workbook.close()
+    parser = SOV_PARSERS[readsheetname]
+    with sov_metrics.stage("read"):
+        worksheet.reset_dimensions()
+        rows = worksheet.iter_rows(
+            max_col=SOV_SHEET_COLUMNS[readsheetname], values_only=True
         )
+        head = [
+            list(row) + [None] * 3 for row in itertools.islice(rows, parser.items_start)
+        ]
+    dfpivot = parser.header(
+        [
+            [_stream_cell(row[1]), _stream_cell(row[2])]
+            for row in head[: parser.header_rows]
+        ]
+    )
+    validate_sov_frame(dfpivot, SOV_PROJECT_SCHEMAS[readsheetname])
+    r_id = resolve_project_id(sql_engine, project_id, keep_max_id)
+    sov_metrics.annotate(id=r_id, sheets=[readsheetname])
+    dfpivot["id"] = r_id
+    line_items = 0
+    staged = None
+    summary = combine_summaries([])
+    ensure_sov_tables(sql_engine)
+    with sql_transaction(sql_engine) as connection:
+        print(f"{label} Upload ID: {r_id}")
+        for chunk in iter_sov_item_chunks(rows, parser, chunk_rows):
+            validate_sov_frame(chunk, SOV_ITEM_SCHEMAS[readsheetname])
+            if bulk_method == "merge":
+                # every chunk goes to one staging table, published at the end
+                staged = stage_sov_items(
+                    connection, readsheetname, chunk.assign(id=r_id), staged
+                )
+            else:
+                with sov_metrics.stage("items_insert"):
+                    bulk_insert(
+                        chunk.assign(id=r_id),
+                        SOV_ITEM_TABLES[readsheetname],
+                        connection,
+                        method=bulk_method,
+                        schema=sql_schema(connection),
+                    )
+                sov_metrics.count("rows_written", len(chunk))
+            line_items += len(chunk)
+            # folded as it goes so only the summary rows are kept
+            summary = combine_summaries(
+                [summary, summarize_upload(readsheetname, dfpivot, chunk)]
+            )
+        insert_project_row(connection, readsheetname, dfpivot)
+        if staged is not None:
+            with sov_metrics.stage("items_insert"):
+                publish_staged(
+                    connection,
+                    staged,
+                    SOV_ITEM_TABLES[readsheetname],
+                    schema=sql_schema(connection),
+                )
+        update_cost_summary(connection, summary)
+        record_ingest(
+            connection,
+            content_hash,
+            readsheetname,
+            r_id,
+            sov_sheet,
+            replace=not skip_duplicates,
+        )
+    print(
+        f"{label} {sov_sheet} successfully uploaded to Database "
+        f"({line_items} line items)"
+    )
+    return r_id
 
-    # drop the old column
-    with sql_engine.begin() as connection:
-        connection.execute("ALTER TABLE solar_projects DROP COLUMN Project_Tracker_ID")
 
-    # rename the new column to the old column's name
-    with sql_engine.begin() as connection:
-        connection.execute(
-            "EXEC sp_rename 'solar_projects.Project_Tracker_ID_int', 'Project_Tracker_ID', 'COLUMN';"
+def upload_solar_sov(sov_sheet, sql_engine, **kwargs) -> int:
+    return upload_sov_sheet(sov_sheet, "Solar SOV", sql_engine, **kwargs)
+
+
+def upload_hv_sov(sov_sheet, sql_engine, **kwargs) -> int:
+    return upload_sov_sheet(sov_sheet, "HV SOV", sql_engine, **kwargs)
+
+
+def upload_storage_sov(sov_sheet, sql_engine, **kwargs) -> int:
+    return upload_sov_sheet(sov_sheet, "Storage SOV", sql_engine, **kwargs)
+
+
+def _stream_cell(value):
+    # mirror pandas' openpyxl conversion: blanks and errors are NaN and
+    # whole-number floats come back as int
+    if value is None or value == "" or value in ERROR_CODES:
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def stream_sov_sheet(worksheet, max_col, blank_row_limit=SOV_BLANK_ROW_LIMIT):
+    # read only the leading max_col columns and stop once the cost table is
+    # followed by blank_row_limit empty rows, so formatted-but-empty cells to
+    # the right of and below the SOV are never materialised
+    worksheet.reset_dimensions()
+    data = []
+    blank_rows = 0
+    for row in worksheet.iter_rows(max_col=max_col, values_only=True):
+        row = [_stream_cell(value) for value in row]
+        if all(pd.isna(value) for value in row):
+            blank_rows += 1
+            if data and blank_rows >= blank_row_limit:
+                break
+        else:
+            # emit the blank rows in between only once more data follows
+            data.extend([[np.nan] * max_col] * blank_rows)
+            data.append(row + [np.nan] * (max_col - len(row)))
+            blank_rows = 0
+    return pd.DataFrame(data).infer_objects()
+
+
+def workbook_size(sov_sheet) -> int:
+    # bytes of a workbook path or an open binary file
+    if hasattr(sov_sheet, "seek"):
+        position = sov_sheet.tell()
+        size = sov_sheet.seek(0, os.SEEK_END)
+        sov_sheet.seek(position)
+        return size
+    return os.path.getsize(sov_sheet)
+
+
+def open_sov_workbook(sov_sheet):
+    # the read-only streaming workbook used by the streaming and chunked paths
+    sov_metrics.count("bytes_read", workbook_size(sov_sheet))
+    with sov_metrics.stage("read"):
+        return openpyxl.load_workbook(
+            sov_sheet, read_only=True, data_only=True, keep_links=False
         )
-    print("Project_id successfully cast to INT")
 
 
-def db_conn_get():
-    driver = "ODBC+Driver+17+for+SQL+Server"
-    database = "EPC_SOV"
-    server = "sdhqhopsql01d"
-    conn_string = "mssql+pyodbc://{srv}/{db}?trusted_connection=yes&driver={dr}".format(
-        dr=driver, srv=server, db=database
-    )
-    engine = sa.create_engine(conn_string)
-    return engine
+def read_sov_workbook(sov_sheet, sheet_names=SOV_SHEET_NAMES, streaming=False) -> dict:
+    # open the workbook once and parse only the SOV sheets it actually contains
+    if streaming:
+        workbook = open_sov_workbook(sov_sheet)
+        try:
+            with sov_metrics.stage("read"):
+                return {
+                    name: stream_sov_sheet(workbook[name], SOV_SHEET_COLUMNS[name])
+                    for name in sheet_names
+                    if name in workbook.sheetnames
+                }
+        finally:
+            workbook.close()
+    sov_metrics.count("bytes_read", workbook_size(sov_sheet))
+    with sov_metrics.stage("read"), pd.ExcelFile(sov_sheet) as xls:
+        return {
+            name: xls.parse(name, header=None)
+            for name in sheet_names
+            if name in xls.sheet_names
+        }
 
 
-def get_max_id(sql_engine):
-    with sql_engine.connect() as connection:
-        result = connection.execute(text("SELECT MAX(id) FROM HV_projects"))
-        max_id_hv = result.fetchone()[0]
-        result = connection.execute(text("SELECT MAX(id) FROM solar_projects"))
-        max_id_solar = result.fetchone()[0]
-        result = connection.execute(text("SELECT MAX(id) FROM storage_projects"))
-        max_id_storage = result.fetchone()[0]
-    return max([max_id_solar, max_id_hv, max_id_storage])
+def _parse_cache_key(sov_sheet, content_hash=None) -> str:
+    # the parser version is part of the key so layout changes invalidate it
+    content_hash = content_hash or file_digest(sov_sheet)
+    return f"{content_hash}-v{SOV_PARSE_VERSION}"
 
 
-def add_id_column(sql_engine):
-    metadata = MetaData()
-    my_table = Table("solar_projects", metadata, autoload_with=sql_engine)
-
-    # Add new column 'id'
-    with sql_engine.begin() as connection:
-        connection.execute("ALTER TABLE solar_projects ADD id INTEGER")
-
-    # Set the new 'id' column to 0 for one row
-    with sql_engine.begin() as connection:
-        connection.execute("UPDATE solar_projects SET id = 0")
-
-
-def excel_epc_sov_to_db(sov_sheet, sql_engine) -> None:
-    # Use the sql_engine t the appropriate columns to the sql server
-
-    # the same list of columns as before
-    # new_columns = [
-    #     "Project_Tracker_ID",
-    # ]
-    # # for each column, create a new ALTER TABLE command
-    # for col_name in new_columns:
-    #     with sql_engine.begin() as connection:
-    #         connection.execute(
-    #             text(f"ALTER TABLE dbo.solar_projects ADD [{col_name}] NVARCHAR(MAX);")
-    #         )
-    # retrieves the template to be used for the EPC-DB
-    readsheetname = "Solar SOV"
-    df_master = pd.read_excel(sov_sheet, sheet_name=readsheetname, header=None)
-    # change the other imports to use master.
-    df = df_master.drop(df_master[df_master.index >= 19].index)
-    df = df.iloc[:, :3]
-    # df.rename(columns={'1': 'ColumnName', '2': 'ColumnValue'}, inplace=True)
-    df.rename(columns={df.columns[1]: "ColumnName"}, inplace=True)
-    df.rename(columns={df.columns[2]: "ColumnValue"}, inplace=True)
-    df.drop(df.columns[[0]], axis=1, inplace=True)
-    df["ColumnValue"] = df["ColumnValue"].astype(str)
-    # test.pivot(index=None, columns='t1',values='t2').bfill().iloc[[0],:]
-    dfpivot = (
-        df.pivot(index=None, columns="ColumnName", values="ColumnValue")
-        .bfill()
-        .iloc[[0], :]
-    )
-    dfpivot.rename(
-        columns={
-            "Project Name": "Project_Name",
-            "Project Tracker ID": "Project_Tracker_ID",
-            "Project Bid Type": "Project_Bid_Type",
-            "Scenario Name": "Scenario_Name",
-            "Scenario ID": "Scenario_ID",
-            "Estimate Source": "Estimate_Source",
-            "Stage Gate": "Stage_Gate",
-            "Milestone": "Milestone",
-            "Design Package": "Design_Package",
-            "EPE Version": "EPE_Version",
-            "Buildable Land Version": "Buildable_Land_Version",
-            "MW DC": "MW_DC",
-            "MW AC": "MW_AC",
-            "Module Count": "Module_Count",
-            "Tracker Row Count": "Tracker_Row_Count",
-            "Labor Type": "Labor_Type",
-            "Contractor": "Contractor",
-            "Date Submitted": "Date_Submitted",
-        },
-        inplace=True,
-    )
-    droplist = dfpivot.columns.astype(str) == "nan"
-    if droplist.any():
-        dfpivot.drop(
-            dfpivot.columns[[i for i, drop in enumerate(droplist) if drop]],
-            axis=1,
-            inplace=True,
+def parse_sov_sheet(sov_sheet, readsheetname, parse_cache=None, content_hash=None):
+    if parse_cache is not None:
+        cache_key = _parse_cache_key(sov_sheet, content_hash)
+        with sov_metrics.stage("parse_cache"):
+            parsed = parse_cache.get(cache_key, readsheetname)
+        if parsed is not None:
+            return parsed
+    sov_metrics.count("bytes_read", workbook_size(sov_sheet))
+    with sov_metrics.stage("read"):
+        df_master = pd.read_excel(sov_sheet, sheet_name=readsheetname, header=None)
+    parsed = SOV_PARSERS[readsheetname](df_master)
+    if parse_cache is not None:
+        parse_cache.put(cache_key, readsheetname, *parsed)
+    return parsed
+
+
+def parse_sov_workbook(
+    sov_sheet, streaming=False, parse_cache=None, content_hash=None
+) -> dict:
+    # (header, line items) for every SOV sheet in the workbook
+    if parse_cache is not None:
+        cache_key = _parse_cache_key(sov_sheet, content_hash)
+        with sov_metrics.stage("parse_cache"):
+            parsed = parse_cache.get_workbook(cache_key)
+        if parsed is not None:
+            return parsed
+    sheets = read_sov_workbook(sov_sheet, streaming=streaming)
+    parsed = {
+        readsheetname: SOV_PARSERS[readsheetname](df_master)
+        for readsheetname, df_master in sheets.items()
+    }
+    if parse_cache is not None and parsed:
+        parse_cache.put_workbook(cache_key, parsed)
+    return parsed
+
+
+@sov_metrics.traced("upload_workbook")
+def upload_sov_workbook(
+    sov_sheet,
+    sql_engine,
+    keep_max_id=False,
+    parsed=None,
+    streaming=False,
+    parse_cache=None,
+    bulk_method="multi",
+    project_id=None,
+    skip_duplicates=True,
+    content_hash=None,
+    delta=False,
+    chunk_rows=None,
+    sheet_names=None,
+) -> int:
+    # sheet_names limits the upload to those SOV sheets of the workbook; a
+    # caller passing content_hash has already checked the ledger
+    if content_hash is None:
+        content_hash = file_digest(sov_sheet)
+        if skip_duplicates:
+            ingested = ingested_ids(sql_engine, [content_hash]).get(content_hash)
+            if ingested:
+                present = list(parsed) if parsed is not None else None
+                sheet_names = pending_sheet_names(sov_sheet, ingested, present)
+                # re-link to the id the identical workbook was uploaded under
+                project_id = max(ingested.values())
+                if not sheet_names:
+                    print(f"{sov_sheet} already uploaded as id {project_id}, skipping")
+                    sov_metrics.annotate(status="skipped", id=project_id)
+                    return project_id
+                print(
+                    f"{sov_sheet} partly uploaded as id {project_id}, "
+                    f"adding {', '.join(sheet_names)}"
+                )
+    if chunk_rows:
+        if parse_cache is not None:
+            raise ValueError(
+                "Chunked uploads stream the sheets and cannot use the parse cache"
+            )
+        return _upload_sov_workbook_chunked(
+            sov_sheet,
+            sql_engine,
+            keep_max_id=keep_max_id,
+            chunk_rows=chunk_rows,
+            bulk_method=bulk_method,
+            project_id=project_id,
+            skip_duplicates=skip_duplicates,
+            content_hash=content_hash,
+            delta=delta,
+            sheet_names=sheet_names,
         )
-    print()
-    conn_db = sql_engine
-    # dfpivot = dfpivot["Project_Tracker_ID"]
-    # dfpivot.to_sql(
-    #     con=conn_db,
-    #     schema="dbo",
-    #     name="solar_projects",
-    #     if_exists="append",
-    #     index=False,
-    # )
-    #
-    # # add the "typical inclusions" column
-    # with sql_engine.begin() as connection:
-    #     connection.execute(
-    #         text("ALTER TABLE dbo.solar_sov ADD [Typical_Inclusions] NVARCHAR(MAX);")
-    #     )
-
-    Project_Tracker_ID = dfpivot["Project_Tracker_ID"][0]
-    query = text(
-        """select id from  solar_projects where Project_Tracker_ID = {}""".format(
-            Project_Tracker_ID, "{}"
+    if parsed is None:
+        parsed = parse_sov_workbook(
+            sov_sheet,
+            streaming=streaming,
+            parse_cache=parse_cache,
+            content_hash=content_hash,
         )
+    if sheet_names is not None:
+        parsed = {name: parsed[name] for name in sheet_names if name in parsed}
+    if not parsed:
+        raise ValueError(f"No SOV sheets found in {sov_sheet}")
+    # every technology of the workbook is linked under the same id
+    project_id = resolve_project_id(sql_engine, project_id, keep_max_id)
+    ensure_sov_tables(sql_engine)
+    # all writes of the workbook share one connection and one transaction, so
+    # a failure never leaves a project row without its line items
+    with sql_transaction(sql_engine) as connection:
+        staged = {}
+        if bulk_method == "merge" and not delta:
+            # stage every sheet before the first write to a live table
+            staged = {
+                readsheetname: stage_sov_items(
+                    connection, readsheetname, df_items.assign(id=project_id)
+                )
+                for readsheetname, (dfpivot, df_items) in parsed.items()
+            }
+        for readsheetname, parsed_sheet in parsed.items():
+            upload_sov_sheet(
+                sov_sheet,
+                readsheetname,
+                connection,
+                parsed=parsed_sheet,
+                bulk_method=bulk_method,
+                project_id=project_id,
+                skip_duplicates=skip_duplicates,
+                content_hash=content_hash,
+                delta=delta,
+                staged=staged.get(readsheetname),
+            )
+    sov_metrics.annotate(id=project_id, sheets=list(parsed))
+    return project_id
+
+
+def _upload_sov_workbook_chunked(
+    sov_sheet,
+    sql_engine,
+    keep_max_id=False,
+    chunk_rows=SOV_CHUNK_ROWS,
+    bulk_method="multi",
+    project_id=None,
+    skip_duplicates=True,
+    content_hash=None,
+    delta=False,
+    sheet_names=None,
+) -> int:
+    # every sheet of the workbook, or of sheet_names, through
+    # upload_sov_sheet_chunked, on one read-only workbook and in one transaction
+    if delta:
+        raise ValueError("Delta uploads diff whole sheets and cannot be chunked")
+    workbook = open_sov_workbook(sov_sheet)
+    try:
+        sheet_names = [
+            name
+            for name in sheet_names or SOV_SHEET_NAMES
+            if name in workbook.sheetnames
+        ]
+        if not sheet_names:
+            raise ValueError(f"No SOV sheets found in {sov_sheet}")
+        project_id = resolve_project_id(sql_engine, project_id, keep_max_id)
+        ensure_sov_tables(sql_engine)
+        with sql_transaction(sql_engine) as connection:
+            for readsheetname in sheet_names:
+                upload_sov_sheet_chunked(
+                    sov_sheet,
+                    readsheetname,
+                    connection,
+                    chunk_rows=chunk_rows,
+                    bulk_method=bulk_method,
+                    project_id=project_id,
+                    skip_duplicates=skip_duplicates,
+                    content_hash=content_hash,
+                    worksheet=workbook[readsheetname],
+                )
+    finally:
+        workbook.close()
+    sov_metrics.annotate(id=project_id, sheets=sheet_names)
+    return project_id
+
+
+def sov_sheet_names(sov_sheet) -> list:
+    # the SOV sheets a workbook contains, read from its sheet list only
+    position = sov_sheet.tell() if hasattr(sov_sheet, "seek") else None
+    workbook = openpyxl.load_workbook(sov_sheet, read_only=True, keep_links=False)
+    try:
+        return [name for name in SOV_SHEET_NAMES if name in workbook.sheetnames]
+    finally:
+        workbook.close()
+        if position is not None:
+            sov_sheet.seek(position)
+
+
+def pending_sheet_names(sov_sheet, ingested, present=None) -> list:
+    # SOV sheets of the workbook the ledger has no entry for under its hash,
+    # given the {sheet name: id} ledger entries and, if known, the sheets
+    return [
+        name
+        for name in (present if present is not None else sov_sheet_names(sov_sheet))
+        if name not in ingested
+    ]
+
+
+def find_sov_workbooks(sov_path) -> list:
+    # a folder means every workbook in it, anything else is treated as a glob
+    if os.path.isdir(sov_path):
+        sov_path = os.path.join(sov_path, "*.xlsx")
+    return sorted(
+        f for f in glob.glob(sov_path) if not os.path.basename(f).startswith("~$")
     )
-    df = pd.read_sql_query(query, conn_db)
-    rid = df["id"][0]
-    df = df_master.drop(df_master[df_master.index <= 20].index)
-    df.rename(columns={df.columns[0]: "Cost_Structure"}, inplace=True)
-    df.rename(columns={df.columns[1]: "Description"}, inplace=True)
-    df.rename(columns={df.columns[2]: "Quantity"}, inplace=True)
-    df.rename(columns={df.columns[3]: "U_M"}, inplace=True)
-    df.rename(columns={df.columns[4]: "Unit_Rate"}, inplace=True)
-    df.rename(columns={df.columns[5]: "Extended_Price"}, inplace=True)
-    df.rename(columns={df.columns[6]: "Price_per_Wp"}, inplace=True)
-    df.rename(columns={df.columns[7]: "Comments"}, inplace=True)
-    df.rename(columns={df.columns[8]: "Typical_Inclusions"}, inplace=True)
-    df = df[df.Cost_Structure.notnull()]
-    df.iloc[:, df.columns.get_loc("id")] = r_id
-
-    df.fillna(value=pd.NA, inplace=True)
-    df.replace("", pd.NA, inplace=True)
-    df.to_sql(
-        con=conn_db, schema="dbo", name="solar_sov", if_exists="append", index=False
+
+
+def batch_upload_sov(
+    sov_path,
+    sql_engine,
+    max_workers=None,
+    streaming=False,
+    parse_cache=None,
+    bulk_method="multi",
+    skip_duplicates=True,
+    delta=False,
+    writers=1,
+) -> list:
+    # Workbooks are parsed in a process pool while writer threads upload the
+    # finished parses, so parsing and database writes overlap. Parses are
+    # handed over through a bounded queue: when the writers fall behind the
+    # queue fills up and no further parses are started, so memory stays flat.
+    # Ids are reserved in file order up front, whatever order the writes
+    # happen in.
+    started = time.perf_counter()
+    sov_files = find_sov_workbooks(sov_path)
+    content_hashes = {sov: file_digest(sov) for sov in sov_files}
+    # workbooks the ledger has only some sheets of: the sheets still missing,
+    # added under the id of the others
+    missing_sheets = {}
+    project_ids = {}
+    if skip_duplicates:
+        # drop workbooks already in the ledger, or repeated within the batch,
+        # before any of them is parsed
+        ingested = ingested_ids(sql_engine, content_hashes.values())
+        seen = set()
+        new_files = []
+        for sov in sov_files:
+            content_hash = content_hashes[sov]
+            if content_hash in ingested and content_hash not in seen:
+                missing_sheets[sov] = pending_sheet_names(sov, ingested[content_hash])
+                project_ids[sov] = max(ingested[content_hash].values())
+            if content_hash in seen or missing_sheets.get(sov) == []:
+                print(f"{sov} already uploaded, skipping")
+                continue
+            if sov in missing_sheets:
+                print(f"{sov} partly uploaded, adding {', '.join(missing_sheets[sov])}")
+            seen.add(content_hash)
+            new_files.append(sov)
+        sov_files = new_files
+    max_workers = max_workers or os.cpu_count() or 1
+    parse = functools.partial(
+        parse_sov_workbook, streaming=streaming, parse_cache=parse_cache
     )
-    print("SQL Uploaded")
-    ## Now for Storage
-    readsheetname = "Storage SOV"
-    df_master = pd.read_excel(sov_sheet, sheet_name=readsheetname, header=None)
-    df = df_master.drop(df_master[df_master.index >= 23].index)
-    df = df.iloc[:, :3]
-    df.rename(columns={df.columns[1]: "ColumnName"}, inplace=True)
-    df.rename(columns={df.columns[2]: "ColumnValue"}, inplace=True)
-    df.drop(df.columns[[0]], axis=1, inplace=True)
-    df["ColumnValue"] = df["ColumnValue"].astype(str)
-    dfpivot = (
-        df.pivot(index=None, columns="ColumnName", values="ColumnValue")
-        .bfill()
-        .iloc[[0], :]
+    # reserve one id per new workbook up front instead of allocating per upload
+    new_files = [sov for sov in sov_files if sov not in project_ids]
+    first_id = allocate_ids(sql_engine, len(new_files)) if new_files else None
+    project_ids.update({sov: first_id + i for i, sov in enumerate(new_files)})
+    # created before the writers start, so concurrent writers never race to
+    # create a missing table
+    ensure_sov_tables(sql_engine)
+    failed = []
+    parsed_queue = Queue(maxsize=max_workers)
+
+    def write_parsed():
+        while True:
+            item = parsed_queue.get()
+            if item is None:
+                return
+            sov, future = item
+            try:
+                upload_sov_workbook(
+                    sov,
+                    sql_engine,
+                    parsed=future.result(),
+                    bulk_method=bulk_method,
+                    project_id=project_ids[sov],
+                    skip_duplicates=skip_duplicates,
+                    content_hash=content_hashes[sov],
+                    delta=delta,
+                    sheet_names=missing_sheets.get(sov),
+                )
+            except Exception as err:
+                print(f"{sov} failed to upload: {err}")
+                failed.append(sov)
+
+    writer_threads = [threading.Thread(target=write_parsed) for _ in range(writers)]
+    for thread in writer_threads:
+        thread.start()
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            # keep a bounded window of parses in flight
+            window = 2 * max_workers
+            sov_iter = iter(sov_files)
+            parsing = {
+                pool.submit(parse, sov, content_hash=content_hashes[sov]): sov
+                for sov in itertools.islice(sov_iter, window)
+            }
+            while parsing:
+                done, _ = wait(parsing, return_when=FIRST_COMPLETED)
+                for future in done:
+                    # blocks while the writers are behind
+                    parsed_queue.put((parsing.pop(future), future))
+                    for next_sov in itertools.islice(sov_iter, 1):
+                        future_parse = pool.submit(
+                            parse, next_sov, content_hash=content_hashes[next_sov]
+                        )
+                        parsing[future_parse] = next_sov
+    finally:
+        for _ in writer_threads:
+            parsed_queue.put(None)
+        for thread in writer_threads:
+            thread.join()
+    print(
+        f"Batch uploaded {len(sov_files) - len(failed)} of {len(sov_files)} "
+        f"workbooks in {time.perf_counter() - started:.1f}s"
     )
+    return failed
+
 
-    dfpivot.rename(
-        columns={
-            "Project Name": "Project_Name",
-            "Project Tracker ID": "Project_Tracker_ID",
-            "Project Bid Type": "Project_Bid_Type",
-            "Scenario Name": "Scenario_Name",
-            "Scenario ID": "Scenario_ID",
-            "Estimate Source": "Estimate_Source",
-            "Stage Gate": "Stage_Gate",
-            "Milestone": "Milestone",
-            "Design Package": "Design_Package",
-            "EPE Version": "EPE_Version",
-            "Buildable Land Version": "Buildable_Land_Version",
-            "BESS OEM": "BESS_OEM",
-            "Product Type": "Product_Type",
-            "Coupling": "Coupling",
-            "Battery Size at POI(MW)": "Battery_Size_at_POI(MW)",
-            "Discharge Duration(hr)": "Discharge_Duration(hr)",
-            "MWh Installed": "MWh_Installed",
-            "BESS Container Quantity": "BESS_Container_Quantity",
-            "PCS Quantity": "PCS_Quantity",
-            "Labor (Union/Prevailing/Non-Union)": "Labor_Type",
-            "Contractor": "Contractor",
-            "Date Submitted": "Date_Submitted",
-        },
-        inplace=True,
+def change_projid_to_integer(sql_engine):
+    # the batched, resumable migration lives in sov_migrate
+    from sov_migrate import change_column_type
+
+    change_column_type(sql_engine, "solar_projects", "Project_Tracker_ID", Integer)
+
+
+def _engine_options(url, settings) -> dict:
+    dialect = sa.engine.make_url(url).get_dialect()
+    options = {"pool_pre_ping": as_bool(settings["pool_pre_ping"])}
+    if dialect.name == "sqlite":
+        # sqlite picks its own pool; the timeout is how long to wait on a lock
+        options["connect_args"] = {"timeout": float(settings["connect_timeout"])}
+        return options
+    options.update(
+        pool_size=int(settings["pool_size"]),
+        max_overflow=int(settings["max_overflow"]),
+        pool_timeout=float(settings["pool_timeout"]),
+        pool_recycle=int(settings["pool_recycle"]),
     )
-    droplist = dfpivot.columns.astype(str) == "nan"
-    if droplist.any():
-        dfpivot.drop(
-            dfpivot.columns[[i for i, drop in enumerate(droplist) if drop]],
-            axis=1,
-            inplace=True,
-        )
-    dfpivot.to_sql(
-        con=conn_db,
-        schema="dbo",
-        name="Storage_projects",
-        if_exists="append",
-        index=False,
+    if dialect.driver == "pyodbc":
+        options["fast_executemany"] = as_bool(settings["fast_executemany"])
+        options["connect_args"] = {"timeout": int(settings["connect_timeout"])}
+    return options
+
+
+def get_engine(url=None, config_path=None, **engine_kwargs):
+    # one pooled engine per process and url; forked workers build their own
+    settings = db_settings(config_path)
+    url = url or db_url(settings)
+    # repr, as option values such as connect_args are not hashable
+    key = (os.getpid(), url, repr(sorted(engine_kwargs.items())))
+    if key not in _engines:
+        options = _engine_options(url, settings)
+        # the caller's connect_args add to the configured ones
+        connect_args = {
+            **options.get("connect_args", {}),
+            **engine_kwargs.get("connect_args", {}),
+        }
+        options.update(engine_kwargs)
+        if connect_args:
+            options["connect_args"] = connect_args
+        _engines[key] = sa.create_engine(url, **options)
+    return _engines[key]
+
+
+def db_conn_get():
+    return get_engine()
+
+
+def get_max_id(sql_engine):
+    # only used to seed the id allocator from the existing project tables
+    max_ids = []
+    with sql_transaction(sql_engine) as connection:
+        inspector = sa.inspect(connection)
+        for table_name in ["HV_projects", "solar_projects", "storage_projects"]:
+            if inspector.has_table(table_name, schema=sql_schema(connection)):
+                result = connection.execute(text(f"SELECT MAX(id) FROM {table_name}"))
+                max_ids.append(result.fetchone()[0])
+    return max((i for i in max_ids if i is not None), default=None)
+
+
+def create_missing_tables(sql_engine, tables) -> None:
+    for table in tables:
+        try:
+            with sql_transaction(sql_engine) as connection:
+                table.create(connection, checkfirst=True)
+        except (OperationalError, ProgrammingError):
+            # fine if another uploader created it between the check and CREATE
+            with sql_transaction(sql_engine) as connection:
+                if not sa.inspect(connection).has_table(table.name):
+                    raise
+
+
+def missing_sov_indexes(sql_engine) -> list:
+    # declared indexes of the SOV tables that the database lacks. Any index
+    # or primary key whose leading columns are the declared ones serves the
+    # same lookups, whatever its name. Tables not created yet are skipped.
+    missing = []
+    with sql_transaction(sql_engine) as connection:
+        inspector = sa.inspect(connection)
+        schema = sql_schema(connection)
+        for table in sov_metadata.sorted_tables:
+            if not inspector.has_table(table.name, schema=schema):
+                continue
+            existing = [
+                [col.lower() for col in index["column_names"] if col]
+                for index in inspector.get_indexes(table.name, schema=schema)
+            ]
+            primary_key = inspector.get_pk_constraint(table.name, schema=schema)
+            existing.append(
+                [col.lower() for col in primary_key.get("constrained_columns") or []]
+            )
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                wanted = [col.name.lower() for col in index.columns]
+                if not any(cols[: len(wanted)] == wanted for cols in existing):
+                    missing.append(index)
+    return missing
+
+
+def ensure_sov_indexes(sql_engine, create=True) -> list:
+    # report the missing indexes of the SOV tables and, with create, build
+    # them; returns the indexes that were missing
+    missing = missing_sov_indexes(sql_engine)
+    for index in missing:
+        columns = ", ".join(col.name for col in index.columns)
+        if not create:
+            print(f"Missing index {index.name} on {index.table.name} ({columns})")
+            continue
+        with sql_transaction(sql_engine) as connection:
+            index.create(connection)
+        print(f"Created index {index.name} on {index.table.name} ({columns})")
+    return missing
+
+
+def ensure_sov_tables(sql_engine) -> None:
+    # create the project and line item tables a database lacks from the
+    # registry, with their declared types and indexes, once per database
+    engine = sql_engine.engine
+    if engine in _sov_tables_ready:
+        return
+    create_missing_tables(sql_engine, sov_metadata.sorted_tables)
+    _sov_tables_ready.add(engine)
+
+
+def ensure_bookkeeping_tables(sql_engine) -> None:
+    # create the allocator and ledger tables once per database and seed the
+    # allocator with the highest id already used by the project tables
+    engine = sql_engine.engine
+    if engine in _bookkeeping_ready:
+        return
+    create_missing_tables(
+        sql_engine, bookkeeping_metadata.sorted_tables + [COST_SUMMARY]
     )
-    # Project_Tracker_ID = dfpivot["Project_Tracker_ID"][0]
-    # # gets the most current id based on project.
-    # query = (
-    #     """select id from  vw_Storage_projects where Project_Tracker_ID = {}""".format(
-    #         Project_Tracker_ID, "{}"
-    #     )
-    # )
-    # df = pd.read_sql_query(query, conn_db)
-    # rid = df["id"][0]
-    # # df.drop(df[df.index <= 19].index, inplace=True)
-    # df = df_master.drop(df_master[df_master.index <= 24].index)
-    # df.rename(columns={df.columns[0]: "Cost_Structure"}, inplace=True)
-    # df.rename(columns={df.columns[1]: "Description"}, inplace=True)
-    # df.rename(columns={df.columns[2]: "Quantity"}, inplace=True)
-    # df.rename(columns={df.columns[3]: "U_M"}, inplace=True)
-    # df.rename(columns={df.columns[4]: "Unit_Rate"}, inplace=True)
-    # df.rename(columns={df.columns[5]: "Extended_Price"}, inplace=True)
-    # df.rename(columns={df.columns[6]: "Price_per_kWh"}, inplace=True)
-    # df.rename(columns={df.columns[7]: "Comments"}, inplace=True)
-    # df = df[df.Cost_Structure.notnull()]
-    # df.iloc[:, df.columns.get_loc("id")] = r_id
-    # df.to_sql(
-    #     con=conn_db, schema="dbo", name="storage_sov", if_exists="append", index=False
-    # )
-
-    # Now for HV
-    # first create the appropriate fields in the database
-    # list of new columns to be added (as per your previous sheet structure)
-    new_columns_sov = [
-        "Cost_Structure",
-        "Description",
-        "Quantity",
-        "U_M",
-        "Unit_Rate",
-        "Extended_Price",
-        "Price_per_Wp",
-        "Comments",
-        "id",
-    ]
-    new_columns_projects = [
-        "Project_Name",
-        "Project_Tracker_ID",
-        "Project_Bid_Type",
-        "Scenario_Name",
-        "Scenario_ID",
-        "Estimate_Source",
-        "Stage_Gate",
-        "Milestone",
-        "Design_Package",
-        "EPE_Version",
-        "Buildable_Land_Version",
-        "MW_AC",
-        "Interconnect_Voltage",
-        "Labor_Type",
-        "Contractor",
-        "Date_submitted",
-    ]
+    for name in (PROJECT_ID_SEQUENCE, DATA_VERSION_SEQUENCE):
+        try:
+            with sql_transaction(sql_engine) as connection:
+                seeded = connection.execute(
+                    select(ID_ALLOCATOR.c.last_id).where(ID_ALLOCATOR.c.name == name)
+                ).first()
+                if seeded is None:
+                    last_id = 0
+                    if name == PROJECT_ID_SEQUENCE:
+                        last_id = get_max_id(connection) or 0
+                    connection.execute(
+                        insert(ID_ALLOCATOR).values(name=name, last_id=last_id)
+                    )
+        except IntegrityError:
+            # another uploader seeded it first
+            pass
+    _bookkeeping_ready.add(engine)
+
 
-    # Create tables and columns
-    with sql_engine.begin() as connection:
-        # Create "HV_projects" table
+def allocate_ids(sql_engine, count=1) -> int:
+    # atomically reserve a block of count project ids and return the first;
+    # the UPDATE row lock serialises concurrent uploaders
+    ensure_bookkeeping_tables(sql_engine)
+    sequence = ID_ALLOCATOR.c.name == PROJECT_ID_SEQUENCE
+    with sql_transaction(sql_engine) as connection:
         connection.execute(
-            text("CREATE TABLE dbo.HV_projects (Project_Tracker_ID NVARCHAR(MAX));")
+            update(ID_ALLOCATOR)
+            .where(sequence)
+            .values(last_id=ID_ALLOCATOR.c.last_id + count)
         )
-        for col_name in new_columns_projects:
-            connection.execute(
-                text(f"ALTER TABLE dbo.HV_projects ADD [{col_name}] NVARCHAR(MAX);")
+        last_id = connection.execute(
+            select(ID_ALLOCATOR.c.last_id).where(sequence)
+        ).scalar()
+    return last_id - count + 1
+
+
+def current_project_id(sql_engine) -> int:
+    # the most recently allocated id, which keep_max_id uploads link to
+    ensure_bookkeeping_tables(sql_engine)
+    with sql_transaction(sql_engine) as connection:
+        return connection.execute(
+            select(ID_ALLOCATOR.c.last_id).where(
+                ID_ALLOCATOR.c.name == PROJECT_ID_SEQUENCE
             )
+        ).scalar()
+
 
-        # Create "HV_sov" table
-        connection.execute(text("CREATE TABLE dbo.HV_sov (id INT);"))
-        for col_name in new_columns_sov:
-            connection.execute(
-                text(f"ALTER TABLE dbo.HV_sov ADD [{col_name}] NVARCHAR(MAX);")
+def ingested_ids(sql_engine, content_hashes) -> dict:
+    # {content hash: {sheet name: id}} for workbooks already in the ledger
+    ensure_bookkeeping_tables(sql_engine)
+    content_hashes = list(dict.fromkeys(content_hashes))
+    ingested = {}
+    with sov_metrics.stage("ledger_lookup"), sql_transaction(sql_engine) as connection:
+        for start in range(0, len(content_hashes), 500):
+            rows = connection.execute(
+                select(
+                    INGEST_LEDGER.c.content_hash,
+                    INGEST_LEDGER.c.sheet_name,
+                    INGEST_LEDGER.c.id,
+                ).where(
+                    INGEST_LEDGER.c.content_hash.in_(
+                        content_hashes[start : start + 500]
+                    )
+                )
             )
+            for content_hash, sheet_name, r_id in rows:
+                ingested.setdefault(content_hash, {})[sheet_name] = r_id
+    return ingested
 
-    # retrieves the template to be used for the EPC-DB
-    readsheetname = "HV SOV"
-    df_master = pd.read_excel(sov_sheet, sheet_name=readsheetname, header=None)
-    # change the other imports to use master.
-    df = df_master.drop(df_master[df_master.index >= 17].index)
-    df = df.iloc[:, :3]
-    # df.rename(columns={'1': 'ColumnName', '2': 'ColumnValue'}, inplace=True)
-    df.rename(columns={df.columns[1]: "ColumnName"}, inplace=True)
-    df.rename(columns={df.columns[2]: "ColumnValue"}, inplace=True)
-    df.drop(df.columns[[0, 3, 4, 5, 6, 7]], axis=1, inplace=True)
-    df["ColumnValue"] = df["ColumnValue"].astype(str)
-    # test.pivot(index=None, columns='t1',values='t2').bfill().iloc[[0],:]
-    dfpivot = (
-        df.pivot(index=None, columns="ColumnName", values="ColumnValue")
-        .bfill()
-        .iloc[[0], :]
-    )
-    dfpivot.rename(
-        columns={
-            "Project Name": "Project_Name",
-            "Project Tracker ID": "Project_Tracker_ID",
-            "Project Bid Type": "Project_Bid_Type",
-            "Scenario Name": "Scenario_Name",
-            "Scenario ID": "Scenario_ID",
-            "Estimate Source": "Estimate_Source",
-            "Stage Gate": "Stage_Gate",
-            "Milestone": "Milestone",
-            "Design Package": "Design_Package",
-            "EPE Version": "EPE_Version",
-            "Buildable Land Version": "Buildable_Land_Version",
-            "MW AC": "MW_AC",
-            "Interconnect Voltage": "Interconnect_Voltage",
-            "Labor Type": "Labor_Type",
-            "Contractor": "Contractor",
-            "Date Submitted": "Date_Submitted",
-        },
-        inplace=True,
+
+def record_ingest(
+    connection, content_hash, readsheetname, r_id, sov_sheet, replace=False
+) -> None:
+    # written in the upload's transaction, which it also counts in the data
+    # version; without replace a concurrent upload of the same workbook fails
+    # on the primary key and rolls back
+    ensure_bookkeeping_tables(connection)
+    entry = (INGEST_LEDGER.c.content_hash == content_hash) & (
+        INGEST_LEDGER.c.sheet_name == readsheetname
     )
-    droplist = dfpivot.columns.astype(str) == "nan"
-    if droplist.any():
-        dfpivot.drop(
-            dfpivot.columns[[i for i, drop in enumerate(droplist) if drop]],
-            axis=1,
-            inplace=True,
+    with sov_metrics.stage("ledger_update"):
+        if replace:
+            connection.execute(INGEST_LEDGER.delete().where(entry))
+        connection.execute(
+            insert(INGEST_LEDGER).values(
+                content_hash=content_hash,
+                sheet_name=readsheetname,
+                id=r_id,
+                source=str(getattr(sov_sheet, "name", sov_sheet))[-260:],
+                ingested_at=datetime.datetime.now(),
+            )
+        )
+        # last in the transaction, so the row lock is held only until commit
+        connection.execute(
+            update(ID_ALLOCATOR)
+            .where(ID_ALLOCATOR.c.name == DATA_VERSION_SEQUENCE)
+            .values(last_id=ID_ALLOCATOR.c.last_id + 1)
+        )
+
+
+def latest_revision_id(connection, readsheetname, project_tracker_id, r_id):
+    # the newest other upload of the same project for this technology
+    if pd.isna(project_tracker_id):
+        return None
+    return connection.execute(
+        text(
+            f"SELECT MAX(id) FROM {SOV_PROJECT_TABLES[readsheetname]} "
+            "WHERE Project_Tracker_ID = :tracker_id AND id <> :id"
+        ),
+        {"tracker_id": int(project_tracker_id), "id": int(r_id)},
+    ).scalar()
+
+
+def read_sov_items(sql_engine, readsheetname, r_id):
+    # the full line items of an upload, rebuilding delta revisions from
+    # their base revision
+    sov_table = SOV_ITEM_TABLES[readsheetname]
+    with sql_transaction(sql_engine) as connection:
+        # only looked up, never created, so readers need no DDL rights
+        inspector = sa.inspect(connection)
+        base_id = None
+        if inspector.has_table(SOV_REVISIONS.name, schema=sql_schema(connection)):
+            base_id = connection.execute(
+                select(SOV_REVISIONS.c.base_id).where(
+                    (SOV_REVISIONS.c.id == int(r_id))
+                    & (SOV_REVISIONS.c.sheet_name == readsheetname)
+                )
+            ).scalar()
+        if base_id is None:
+            return pd.read_sql_query(
+                text(f"SELECT * FROM {sov_table} WHERE id = :id"),
+                connection,
+                params={"id": int(r_id)},
+            )
+        base = read_sov_items(connection, readsheetname, base_id)
+        delta_table = f"{sov_table}_delta"
+        if inspector.has_table(delta_table, schema=sql_schema(connection)):
+            changes = pd.read_sql_query(
+                text(f"SELECT * FROM {delta_table} WHERE id = :id"),
+                connection,
+                params={"id": int(r_id)},
+            )
+        else:
+            changes = base.head(0).assign(Delta_Op=None, Delta_Seq=None)
+    return apply_sov_delta(base, changes).assign(id=r_id)
+
+
+def rebuild_cost_summary(sql_engine, chunk_rows=SOV_CHUNK_ROWS) -> int:
+    # Recompute the cost summary from every stored upload, e.g. to fill it on
+    # a database that predates it. Line items are read chunk_rows at a time;
+    # delta revisions are rebuilt from their base. Returns the summary rows.
+    ensure_bookkeeping_tables(sql_engine)
+    summary = combine_summaries([])
+    with sql_transaction(sql_engine) as connection:
+        inspector = sa.inspect(connection)
+        schema = sql_schema(connection)
+        for readsheetname, layout in SOV_LAYOUTS.items():
+            project_table = SOV_PROJECT_SCHEMAS[readsheetname]
+            item_table = SOV_ITEM_SCHEMAS[readsheetname]
+            if not (
+                inspector.has_table(project_table.name, schema=schema)
+                and inspector.has_table(item_table.name, schema=schema)
+            ):
+                continue
+            headers = pd.read_sql_query(
+                select(
+                    project_table.c.id,
+                    project_table.c.Contractor,
+                    project_table.c.Stage_Gate,
+                    project_table.c.Date_Submitted,
+                ),
+                connection,
+            ).drop_duplicates("id", keep="last")
+            headers["Technology"] = layout["label"]
+            headers["Submitted_Month"] = (
+                pd.to_datetime(headers.pop("Date_Submitted"), errors="coerce")
+                .dt.strftime("%Y-%m")
+                .fillna("")
+            )
+            # the revision ids are fetched in full and the revisions rebuilt
+            # only once the chunked read is exhausted, as a driver without
+            # multiple active result sets (pyodbc on SQL Server) runs one
+            # query at a time on the connection
+            revisions = (
+                connection.execute(
+                    select(SOV_REVISIONS.c.id).where(
+                        SOV_REVISIONS.c.sheet_name == readsheetname
+                    )
+                )
+                .scalars()
+                .all()
+            )
+            chunks = pd.read_sql_query(
+                select(item_table), connection, chunksize=chunk_rows
+            )
+            chunks = itertools.chain(
+                chunks,
+                (read_sov_items(connection, readsheetname, r_id) for r_id in revisions),
+            )
+            for chunk in chunks:
+                summary = combine_summaries(
+                    [
+                        summary,
+                        summarize_sov_items(
+                            chunk.merge(headers, on="id"), layout["unit_price"]
+                        ),
+                    ]
+                )
+        connection.execute(COST_SUMMARY.delete())
+        merge_cost_summary(connection, summary)
+    print(f"Cost summary rebuilt with {len(summary)} rows")
+    return len(summary)
+
+
+def write_sov_items(
+    connection,
+    readsheetname,
+    df,
+    r_id,
+    project_tracker_id,
+    bulk_method="multi",
+    delta=False,
+    staged=None,
+) -> None:
+    # a delta upload stores only the rows that differ from the latest stored
+    # revision of the project, in <sov table>_delta, plus a pointer to it.
+    # Rows already loaded into the staging table staged are published from it.
+    sov_table = SOV_ITEM_TABLES[readsheetname]
+    base_id = None
+    if delta:
+        ensure_bookkeeping_tables(connection)
+        base_id = latest_revision_id(
+            connection, readsheetname, project_tracker_id, r_id
+        )
+    if base_id is None and staged is not None:
+        with sov_metrics.stage("items_insert"):
+            publish_staged(connection, staged, sov_table, schema=sql_schema(connection))
+        return
+    if base_id is None:
+        with sov_metrics.stage("items_insert"):
+            bulk_insert(
+                df,
+                sov_table,
+                connection,
+                method=bulk_method,
+                schema=sql_schema(connection),
+            )
+        sov_metrics.count("rows_written", len(df))
+        return
+    with sov_metrics.stage("delta_diff"):
+        base = read_sov_items(connection, readsheetname, base_id)
+        changes = diff_sov_items(base, df).assign(id=r_id)
+    with sov_metrics.stage("items_insert"):
+        bulk_insert(
+            changes,
+            f"{sov_table}_delta",
+            connection,
+            method=bulk_method,
+            schema=sql_schema(connection),
+        )
+    sov_metrics.count("rows_written", len(changes))
+    connection.execute(
+        insert(SOV_REVISIONS).values(
+            id=int(r_id), sheet_name=readsheetname, base_id=base_id
         )
-    conn_db = sql_engine
-    dfpivot.to_sql(
-        con=conn_db,
-        schema="dbo",
-        name="HV_projects",
-        if_exists="append",
-        index=False,
     )
-    # Project_Tracker_ID = dfpivot["Project_Tracker_ID"][0]
-    # query = (
-    #     """select id from  vw_solar_projects where Project_Tracker_ID = {}""".format(
-    #         Project_Tracker_ID, "{}"
-    #     )
-    # )
-    # df = pd.read_sql_query(query, conn_db)
-    # rid = df["id"][0]
-    # df = df_master.drop(df_master[df_master.index <= 18].index)
-    # df.rename(columns={df.columns[0]: "Cost_Structure"}, inplace=True)
-    # df.rename(columns={df.columns[1]: "Description"}, inplace=True)
-    # df.rename(columns={df.columns[2]: "Quantity"}, inplace=True)
-    # df.rename(columns={df.columns[3]: "U_M"}, inplace=True)
-    # df.rename(columns={df.columns[4]: "Unit_Rate"}, inplace=True)
-    # df.rename(columns={df.columns[5]: "Extended_Price"}, inplace=True)
-    # df.rename(columns={df.columns[6]: "Price_per_Wp"}, inplace=True)
-    # df.rename(columns={df.columns[7]: "Comments"}, inplace=True)
-    # df = df[df.Cost_Structure.notnull()]
-    # df.iloc[:, df.columns.get_loc("id")] = r_id
-    # df.to_sql(con=conn_db, schema="dbo", name="HV_sov", if_exists="append", index=False)
-    print()
+    print(f"{readsheetname} stored as {len(changes)} changed rows against id {base_id}")
+
+
+def add_id_column(sql_engine):
+    from sov_migrate import add_id_column as migrate_add_id_column
+
+    migrate_add_id_column(sql_engine, "solar_projects")
 
 
 if __name__ == "__main__":
-    conn_db = db_conn_get()
-    sov_fdir = "C:\\Users\\nils.rundquist\\PycharmProjects\\pythonProject\\"
-    # sov = "Milagro_Blattner_2023-02-27_PV_Storage_HV.xlsx"
-    # upload_solar_sov(sov, conn_db)
-    # upload_hv_sov(sov, conn_db)
-    # upload_storage_sov(sov, conn_db)
-    sov = "Milagro_EPCS_2023-02-27_HV.xlsx"
-    upload_hv_sov(sov, conn_db)
-    sov = "Milagro_EPCS_2023-02-27_HV_Adjusted.xlsx"
-    upload_hv_sov(sov, conn_db)
-    sov = "Milagro_EPCS_2023-03-06_Storage.xlsx"
-    upload_storage_sov(sov, conn_db)
-    sov = "Milagro_Rosendin_2023-03-01_PV_Storage_HV.xlsx"
-    upload_solar_sov(sov, conn_db)
-    upload_hv_sov(sov, conn_db, keep_max_id=True)
-    upload_storage_sov(sov, conn_db, keep_max_id=True)
-    sov = "Milagro_Rosendin_2023-03-15_Storage_HV.xlsx"
-    upload_hv_sov(sov, conn_db)
-    upload_storage_sov(sov, conn_db, keep_max_id=True)
-    sov = "Milagro_Rosendin_2023-03-15_Storage_Adjusted.xlsx"
-    upload_storage_sov(sov, conn_db)
+    from sov_cli import main
+
+    raise SystemExit(main())
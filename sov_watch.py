@@ -0,0 +1,217 @@
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import sov_to_epcdb
+
+# the queue lives on local disk; SQLite files on a network share are not safe
+DEFAULT_QUEUE_PATH = os.path.join("~", ".sov", "ingest_queue.db")
+# retry delays double from RETRY_BACKOFF up to MAX_RETRY_BACKOFF seconds
+RETRY_BACKOFF = 5.0
+MAX_RETRY_BACKOFF = 600.0
+MAX_ATTEMPTS = 5
+
+
+class IngestQueue:
+    # Durable queue of dropped workbooks, one row per path. A row is pending
+    # until a worker claims it (running) and ends up done, or failed once
+    # max_attempts uploads have failed. A file that changes on disk is queued
+    # again from scratch.
+
+    def __init__(self, queue_path=DEFAULT_QUEUE_PATH):
+        self.queue_path = os.path.expanduser(queue_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.queue_path)), exist_ok=True)
+        self.db = sqlite3.connect(self.queue_path, isolation_level=None, timeout=30)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS ingest_queue ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime REAL, "
+            "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "next_attempt REAL NOT NULL DEFAULT 0, project_id INTEGER, "
+            "last_error TEXT, updated_at REAL)"
+        )
+
+    def recover(self) -> None:
+        # uploads still marked running were interrupted by a crash or restart
+        self.db.execute(
+            "UPDATE ingest_queue SET status = 'pending' WHERE status = 'running'"
+        )
+
+    def offer(self, path, size, mtime) -> bool:
+        # queue a new or changed file; True if it was queued
+        row = self.db.execute(
+            "SELECT size, mtime, status FROM ingest_queue WHERE path = ?", (path,)
+        ).fetchone()
+        if row is not None and (row[2] == "running" or row[:2] == (size, mtime)):
+            return False
+        self.db.execute(
+            "INSERT INTO ingest_queue (path, size, mtime, status, updated_at) "
+            "VALUES (?, ?, ?, 'pending', ?) ON CONFLICT(path) DO UPDATE SET "
+            "size = excluded.size, mtime = excluded.mtime, status = 'pending', "
+            "attempts = 0, next_attempt = 0, last_error = NULL, "
+            "updated_at = excluded.updated_at",
+            (path, size, mtime, time.time()),
+        )
+        return True
+
+    def claim(self, limit) -> list:
+        # mark up to limit due files as running and return their paths
+        if limit <= 0:
+            return []
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            paths = [
+                path
+                for (path,) in self.db.execute(
+                    "SELECT path FROM ingest_queue WHERE status = 'pending' "
+                    "AND next_attempt <= ? ORDER BY next_attempt, path LIMIT ?",
+                    (time.time(), limit),
+                )
+            ]
+            self.db.executemany(
+                "UPDATE ingest_queue SET status = 'running', updated_at = ? "
+                "WHERE path = ?",
+                [(time.time(), path) for path in paths],
+            )
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return paths
+
+    def done(self, path, project_id) -> None:
+        self.db.execute(
+            "UPDATE ingest_queue SET status = 'done', project_id = ?, "
+            "last_error = NULL, updated_at = ? WHERE path = ?",
+            (project_id, time.time(), path),
+        )
+
+    def retry(
+        self,
+        path,
+        error,
+        max_attempts=MAX_ATTEMPTS,
+        backoff=RETRY_BACKOFF,
+        max_backoff=MAX_RETRY_BACKOFF,
+    ) -> bool:
+        # back off exponentially; False once the file has used up its attempts
+        attempts = (
+            self.db.execute(
+                "SELECT attempts FROM ingest_queue WHERE path = ?", (path,)
+            ).fetchone()[0]
+            + 1
+        )
+        status = "pending" if attempts < max_attempts else "failed"
+        delay = min(max_backoff, backoff * 2 ** (attempts - 1))
+        self.db.execute(
+            "UPDATE ingest_queue SET status = ?, attempts = ?, next_attempt = ?, "
+            "last_error = ?, updated_at = ? WHERE path = ?",
+            (status, attempts, time.time() + delay, str(error), time.time(), path),
+        )
+        return status == "pending"
+
+    def counts(self) -> dict:
+        return dict(
+            self.db.execute("SELECT status, COUNT(*) FROM ingest_queue GROUP BY status")
+        )
+
+    def has_due(self) -> bool:
+        return (
+            self.db.execute(
+                "SELECT 1 FROM ingest_queue WHERE status = 'pending' "
+                "AND next_attempt <= ? LIMIT 1",
+                (time.time(),),
+            ).fetchone()
+            is not None
+        )
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def _file_state(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime
+
+
+def _upload_file(path, db_url, config_path, upload_options) -> int:
+    # runs in a worker process, which builds its own pooled engine
+    sql_engine = sov_to_epcdb.get_engine(db_url, config_path=config_path)
+    return sov_to_epcdb.upload_sov_workbook(path, sql_engine, **upload_options)
+
+
+def watch_folder(
+    folder,
+    db_url=None,
+    config_path=None,
+    queue_path=DEFAULT_QUEUE_PATH,
+    poll_interval=2.0,
+    max_workers=2,
+    max_attempts=MAX_ATTEMPTS,
+    backoff=RETRY_BACKOFF,
+    once=False,
+    **upload_options,
+) -> dict:
+    # Poll folder for new or changed workbooks and upload them through
+    # upload_sov_workbook with at most max_workers uploads at a time. Shared
+    # drives do not deliver change notifications reliably, so the folder is
+    # polled; a file is only queued once its size and mtime held still for a
+    # whole poll, so half-copied workbooks are left alone. With once the
+    # watcher stops as soon as nothing is left to do right now.
+    queue = IngestQueue(queue_path)
+    queue.recover()
+    previous = {}
+    running = {}
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            while True:
+                current = {
+                    path: _file_state(path)
+                    for path in sov_to_epcdb.find_sov_workbooks(folder)
+                }
+                offered = False
+                for path, state in current.items():
+                    if state is not None and previous.get(path) == state:
+                        offered = queue.offer(path, *state) or offered
+                # files seen for the first time still need a second poll
+                unsettled = any(path not in previous for path in current)
+                previous = current
+
+                for path, future in list(running.items()):
+                    if not future.done():
+                        continue
+                    del running[path]
+                    try:
+                        project_id = future.result()
+                    except Exception as err:
+                        if queue.retry(
+                            path, err, max_attempts=max_attempts, backoff=backoff
+                        ):
+                            print(f"{path} failed to upload, will retry: {err}")
+                        else:
+                            print(f"{path} failed to upload, giving up: {err}")
+                    else:
+                        queue.done(path, project_id)
+                for path in queue.claim(max_workers - len(running)):
+                    running[path] = pool.submit(
+                        _upload_file, path, db_url, config_path, upload_options
+                    )
+
+                if (
+                    once
+                    and not running
+                    and not offered
+                    and not unsettled
+                    and not queue.has_due()
+                ):
+                    break
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("Watcher stopped; unfinished uploads resume on the next start")
+    finally:
+        counts = queue.counts()
+        queue.close()
+    return counts
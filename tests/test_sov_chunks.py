@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+import sov_to_epcdb
+from sov_bench import generate_sov_workbook
+
+
+def stored(engine):
+    with engine.connect() as connection:
+        return {
+            table: pd.read_sql_query(
+                f"SELECT * FROM {table} ORDER BY rowid", connection
+            )
+            .astype(object)
+            .where(lambda df: df.notna(), None)
+            .values.tolist()
+            for table in sov_to_epcdb.SOV_ITEM_TABLES.values()
+        }
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 2])
+def test_chunked_upload_matches_full_upload(tmp_path, chunk_rows):
+    # a note row and the total rows of every sheet land on either side of a
+    # chunk boundary, and the totals must still be kept without a cost
+    # structure
+    workbook = tmp_path / "sov.xlsx"
+    generate_sov_workbook(workbook, rows=7, note_every=3)
+
+    full = sa.create_engine(f"sqlite:///{tmp_path / 'full.db'}")
+    chunked = sa.create_engine(f"sqlite:///{tmp_path / 'chunked.db'}")
+    sov_to_epcdb.upload_sov_workbook(workbook, full)
+    sov_to_epcdb.upload_sov_workbook(workbook, chunked, chunk_rows=chunk_rows)
+
+    expected = stored(full)
+    assert stored(chunked) == expected
+    for readsheetname, table in sov_to_epcdb.SOV_ITEM_TABLES.items():
+        total_rows = sov_to_epcdb.SOV_LAYOUTS[readsheetname]["total_rows"]
+        assert [row[0] for row in expected[table][-total_rows:]] == [""] * total_rows
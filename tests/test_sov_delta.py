@@ -0,0 +1,99 @@
+import pandas as pd
+import sqlalchemy as sa
+
+import sov_to_epcdb
+from sov_delta import DELTA_ADDED, DELTA_CHANGED, DELTA_REMOVED, diff_sov_items
+
+SHEET = "HV SOV"
+COLUMNS = sov_to_epcdb.SOV_LAYOUTS[SHEET]["items"]
+BASE = [
+    ["1.0", "Mobilization", "1", "LS", "5000", "5000", "0.05", pd.NA],
+    ["2.0", "Cable", "100", "LF", "12", "1200", "0.01", pd.NA],
+    ["2.0", "Cable", "200", "LF", "12", "2400", "0.02", "second run"],
+    ["3.0", "Transformer", "1", "EA", "90000", "90000", "0.9", pd.NA],
+    ["4.0", "Testing", "1", "LS", "800", "800", "0.01", pd.NA],
+]
+
+
+def items(rows):
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def upload(engine, rows, content_hash, delta=False):
+    header = pd.DataFrame(
+        [
+            {
+                "Project_Name": "Delta test",
+                "Project_Tracker_ID": 2002,
+                "Contractor": "Acme",
+                "Date_Submitted": pd.Timestamp("2024-01-05"),
+            }
+        ]
+    )
+    return sov_to_epcdb.upload_sov_sheet(
+        "delta_test.xlsx",
+        SHEET,
+        engine,
+        parsed=(header, items(rows)),
+        content_hash=content_hash,
+        delta=delta,
+    )
+
+
+def cells(df):
+    return df.astype(object).where(df.notna(), None).values.tolist()
+
+
+def stored(engine, r_id):
+    return cells(sov_to_epcdb.read_sov_items(engine, SHEET, r_id)[COLUMNS])
+
+
+def test_diff_tells_repeated_keys_apart():
+    new = [list(row) for row in BASE]
+    new[2][2] = "250"
+    new.append(["2.0", "Cable", "50", "LF", "12", "600", "0.01", pd.NA])
+    del new[4]
+    delta = diff_sov_items(items(BASE), items(new))
+    # removed rows carry only their keys
+    assert sorted(zip(delta["Delta_Op"], delta["Description"], delta["Delta_Seq"])) == [
+        (DELTA_ADDED, "Cable", 2),
+        (DELTA_CHANGED, "Cable", 1),
+        (DELTA_REMOVED, "Testing", 0),
+    ]
+    quantities = dict(zip(delta["Delta_Op"], delta["Quantity"]))
+    assert quantities[DELTA_CHANGED] == "250"
+    assert quantities[DELTA_ADDED] == "50"
+
+
+def test_delta_revisions_rebuild_through_read_sov_items(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'sov.db'}")
+    base_id = upload(engine, BASE, "base")
+
+    # the second Cable row changes, Testing is removed, two rows are added
+    revised = [list(row) for row in BASE]
+    revised[2][5] = "2600"
+    revised[2][7] = pd.NA
+    del revised[4]
+    revised.append(["2.0", "Cable", "50", "LF", "12", "600", "0.01", pd.NA])
+    revised.append(["5.0", "Commissioning", "1", "LS", "1500", "1500", "0.02", "new"])
+    revised_id = upload(engine, revised, "revised", delta=True)
+
+    # a revision of the delta revision, rebuilt through both of them
+    again = [list(row) for row in revised]
+    del again[0]
+    again[-1][4] = "1750"
+    again_id = upload(engine, again, "again", delta=True)
+
+    with engine.connect() as connection:
+        deltas = pd.read_sql_query(
+            "SELECT id, Delta_Op FROM HV_sov_delta ORDER BY id", connection
+        )
+        base_rows = connection.execute(
+            sa.text("SELECT COUNT(*) FROM HV_sov WHERE id <> :id"), {"id": base_id}
+        ).scalar()
+    # only the base revision is stored in full
+    assert base_rows == 0
+    assert deltas.groupby("id").size().to_dict() == {revised_id: 4, again_id: 2}
+    assert stored(engine, base_id) == cells(items(BASE))
+    assert stored(engine, revised_id) == cells(items(revised))
+    assert stored(engine, again_id) == cells(items(again))
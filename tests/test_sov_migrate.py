@@ -0,0 +1,121 @@
+import sqlite3
+
+import pytest
+import sqlalchemy as sa
+
+import sov_migrate
+
+ROWS = 2300
+BATCH_ROWS = 200
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    # a project table as pandas created it, before the id column existed
+    path = tmp_path / "legacy.db"
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "CREATE TABLE solar_projects "
+            "(Project_Name TEXT, Project_Tracker_ID TEXT, MW_DC REAL)"
+        )
+        connection.executemany(
+            "INSERT INTO solar_projects VALUES (?, ?, 1.5)",
+            [
+                (f"p{i}", None if i % 97 == 0 else str(1000 + i // 3))
+                for i in range(ROWS)
+            ],
+        )
+    return path
+
+
+def interrupt_during(monkeypatch, batch, during_batch=None):
+    # fail the retype inside its batch-th batch, which rolls back;
+    # during_batch runs inside the second one, like a concurrent upload
+    save = sov_migrate.save_migration_state
+    done = []
+
+    def save_then_interrupt(connection, name, step, *args, **kwargs):
+        save(connection, name, step, *args, **kwargs)
+        if step == "backfill" and name.startswith("retype"):
+            done.append(name)
+            if len(done) == 2 and during_batch:
+                during_batch(connection)
+            if len(done) == batch:
+                raise Interrupted()
+
+    monkeypatch.setattr(sov_migrate, "save_migration_state", save_then_interrupt)
+
+
+def test_interrupted_retype_resumes(legacy_db, monkeypatch):
+    engine = sa.create_engine(f"sqlite:///{legacy_db}")
+    sov_migrate.add_id_column(engine, "solar_projects", batch_rows=BATCH_ROWS)
+
+    def upload(connection):
+        connection.execute(
+            sa.text(
+                "INSERT INTO solar_projects (Project_Name, Project_Tracker_ID, id) "
+                "VALUES ('new', '1001', 77)"
+            )
+        )
+
+    interrupt_during(monkeypatch, 4, during_batch=upload)
+    with pytest.raises(Interrupted):
+        sov_migrate.change_column_type(
+            engine,
+            "solar_projects",
+            "Project_Tracker_ID",
+            sa.Integer,
+            batch_rows=BATCH_ROWS,
+        )
+    monkeypatch.undo()
+    state = sov_migrate.migration_state(
+        engine, "retype:solar_projects.Project_Tracker_ID"
+    )
+    assert state["step"] == "backfill"
+    assert state["rows_done"] == 3 * BATCH_ROWS
+    with engine.connect() as connection:
+        # the batches find the pending rows through the index, not a scan
+        plan = connection.execute(
+            sa.text(
+                "EXPLAIN QUERY PLAN SELECT rowid FROM solar_projects "
+                "WHERE Project_Tracker_ID_new IS NULL "
+                "AND Project_Tracker_ID IS NOT NULL LIMIT 10"
+            )
+        ).fetchall()
+    assert "ix_solar_projects_Project_Tracker_ID_new_pending" in str(plan)
+
+    sov_migrate.run_migrations(engine, batch_rows=BATCH_ROWS)
+
+    with engine.connect() as connection:
+        columns = {
+            column["name"]: column["type"]
+            for column in sa.inspect(connection).get_columns("solar_projects")
+        }
+        indexes = sa.inspect(connection).get_indexes("solar_projects")
+        counts = connection.execute(
+            sa.text(
+                "SELECT COUNT(*), COUNT(Project_Tracker_ID), "
+                "SUM(typeof(Project_Tracker_ID) = 'integer'), SUM(id = 0) "
+                "FROM solar_projects"
+            )
+        ).one()
+        new = connection.execute(
+            sa.text(
+                "SELECT Project_Tracker_ID, id FROM solar_projects WHERE Project_Name = 'new'"
+            )
+        ).one()
+    assert set(columns) == {"Project_Name", "Project_Tracker_ID", "MW_DC", "id"}
+    assert isinstance(columns["Project_Tracker_ID"], sa.Integer)
+    assert indexes == []
+    nulls = len(range(0, ROWS, 97))
+    assert tuple(counts) == (ROWS + 1, ROWS + 1 - nulls, ROWS + 1 - nulls, ROWS)
+    assert tuple(new) == (1001, 77)
+    state = sov_migrate.migration_state(
+        engine, "retype:solar_projects.Project_Tracker_ID"
+    )
+    assert state["step"] == "done"
+    assert state["rows_done"] == ROWS + 1 - nulls
@@ -0,0 +1,55 @@
+import pandas as pd
+import sqlalchemy as sa
+
+import sov_read
+import sov_to_epcdb
+
+SHEET = "HV SOV"
+COLUMNS = sov_to_epcdb.SOV_LAYOUTS[SHEET]["items"]
+HEADER = pd.DataFrame([{"Project_Name": "Read test", "Project_Tracker_ID": 3003}])
+
+
+def items(description):
+    return pd.DataFrame(
+        [["1.0", description, "1", "LS", "100", "100", "0.01", pd.NA]],
+        columns=COLUMNS,
+    )
+
+
+def upload(engine, description, **options):
+    return sov_to_epcdb.upload_sov_sheet(
+        "read_test.xlsx",
+        SHEET,
+        engine,
+        parsed=(HEADER, items(description)),
+        content_hash="read-test",
+        **options,
+    )
+
+
+def descriptions(engine, r_id, use_cache=True):
+    _, fetched = sov_read.fetch_sov(engine, r_id, use_cache=use_cache)[SHEET]
+    return sorted(fetched["Description"])
+
+
+def test_reupload_under_the_same_id_invalidates_cached_reads(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'sov.db'}")
+    r_id = upload(engine, "first")
+    assert descriptions(engine, r_id) == ["first"]
+
+    # neither a new id nor a new ledger row: the id is reused and the ledger
+    # row of the same content hash is replaced
+    upload(engine, "second", project_id=r_id, skip_duplicates=False)
+    assert descriptions(engine, r_id) == ["first", "second"]
+    assert descriptions(engine, r_id) == descriptions(engine, r_id, use_cache=False)
+
+
+def test_results_read_at_an_older_version_are_not_cached():
+    cache = sov_read.SovReadCache()
+    cache.sync(1, set())
+    # another reader saw an upload and moved the cache on meanwhile
+    cache.sync(2, set())
+    cache.put(("id", 1), {"stale": None}, 1)
+    assert cache.get(("id", 1)) is None
+    cache.put(("id", 1), {"fresh": None}, 2)
+    assert cache.get(("id", 1)) == {"fresh": None}